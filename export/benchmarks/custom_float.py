@@ -0,0 +1,51 @@
+"""
+Times the decoding of a b-scan with the custom float lookup tables against the per-pixel read_custom_float it replaced.
+Run from the export folder: python benchmarks/custom_float.py
+"""
+import argparse
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from oct_converter.readers.e2e import GAMMA, custom_float_table, read_custom_float
+
+
+def per_pixel(raw, width, height):
+    """ The decoding before the lookup tables: one read_custom_float call per pixel """
+    values = [256 * read_custom_float(raw[i:i + 2]) ** GAMMA for i in range(0, 2 * width * height, 2)]
+    return np.array(values).reshape(width, height)
+
+
+def lookup(raw, width, height, dtype=np.float64):
+    return np.take(custom_float_table(dtype), np.frombuffer(raw, dtype='<u2').reshape(width, height))
+
+
+def best_of(function, repeat):
+    times = []
+    for _ in range(repeat):
+        tic = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - tic)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-wi", "--width", help="Width of the b-scan", type=int, default=512)
+    parser.add_argument("-he", "--height", help="Height of the b-scan", type=int, default=496)
+    parser.add_argument("-r", "--repeat", help="Number of timings, the best one is kept", type=int, default=5)
+    args = parser.parse_args()
+
+    raw = np.random.default_rng(0).integers(0, pow(2, 16), args.width * args.height, dtype=np.uint16).tobytes()
+    assert np.array_equal(per_pixel(raw, args.width, args.height), lookup(raw, args.width, args.height))
+    # the tables are built once per process, outside of the timings
+    for dtype in [np.float64, np.uint8]:
+        custom_float_table(dtype)
+
+    old = best_of(lambda: per_pixel(raw, args.width, args.height), 1)
+    print('%-22s %10.2f ms' % ('read_custom_float', 1000 * old))
+    for dtype in [np.float64, np.uint8]:
+        new = best_of(lambda: lookup(raw, args.width, args.height, dtype), args.repeat)
+        print('%-22s %10.2f ms  x%.0f' % ('lookup table ' + np.dtype(dtype).name, 1000 * new, old / new))
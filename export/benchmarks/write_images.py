@@ -0,0 +1,67 @@
+"""
+Times save_slices writing a stack of b-scans as .png slices, by number of writing threads and png compression level.
+Run from the export folder: python benchmarks/write_images.py
+"""
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from oct_converter.image_types.oct import save_slices
+
+
+def bscans(num_slices, width, height):
+    """ 8 bits b-scans of smooth layers and speckle, which compress about as well as real ones """
+    rng = np.random.default_rng(0)
+    layers = 128 + 64 * np.sin(np.linspace(0, 12, width))[:, np.newaxis] * np.cos(np.linspace(0, 3, height))
+    return np.clip(layers + rng.normal(0, 8, (num_slices, width, height)), 0, 255).astype(np.uint8)
+
+
+def time_save(volume, folder, workers, png_compression):
+    """
+    :return: Seconds spent saving the volume, and bytes written
+    """
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    tic = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        written = save_slices(os.path.join(folder, 'data.png'), enumerate(volume), len(volume), workers,
+                              png_compression)
+    seconds = time.perf_counter() - tic
+    return seconds, sum(os.path.getsize(filename) for filename in written)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--num_slices", help="Number of b-scans of the volume", type=int, default=49)
+    parser.add_argument("-wi", "--width", help="Width of the b-scans", type=int, default=512)
+    parser.add_argument("-he", "--height", help="Height of the b-scans", type=int, default=496)
+    parser.add_argument("-w", "--workers", help="Numbers of writing threads compared", type=int, nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument("-c", "--compression", help="png compression levels compared", type=int, nargs='+',
+                        default=[0, 1, 3, 6, 9])
+    parser.add_argument("-r", "--repeat", help="Number of timings, the best one is kept", type=int, default=3)
+    args = parser.parse_args()
+
+    volume = bscans(args.num_slices, args.width, args.height)
+    root = tempfile.mkdtemp()
+    print('%i cpu(s), %i b-scans of %ix%i' % (os.cpu_count(), args.num_slices, args.width, args.height))
+    print('%11s %7s %10s %8s %10s' % ('compression', 'workers', 'time', 'speedup', 'size'))
+    try:
+        for png_compression in args.compression:
+            serial = None
+            for workers in args.workers:
+                timings = [time_save(volume, os.path.join(root, 'out'), workers, png_compression)
+                           for _ in range(args.repeat)]
+                seconds, size = min(timings)
+                serial = seconds if serial is None else serial
+                print('%11i %7i %7.0f ms %7.2fx %7.1f MB' % (png_compression, workers, 1000 * seconds,
+                                                             serial / seconds, size / pow(2, 20)))
+    finally:
+        shutil.rmtree(root)
@@ -0,0 +1,119 @@
+import argparse
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from tqdm import tqdm
+from oct_converter.readers import E2E, FDS
+from e2eexporter import LogProcessor
+from zeiss.zeiss_exporter import ZeissExporter
+
+COLUMNS = ['filepath', 'format', 'patient_id', 'patient_name', 'patient_surname', 'visit_date', 'eye', 'type',
+           'series_id', 'num_series', 'num_slices', 'height', 'width']
+
+
+class CatalogBuilder:
+    """
+    Builds a catalog of the volumes contained in an archive, with one row per volume, from the headers of the files
+    only: no pixel data is read.
+    """
+    def __init__(self, root, log_filepath=None, zeiss_data=None, zeiss_xml=None, workers=8):
+        self.root = root
+        self.log = LogProcessor(log_filepath)
+        self.zeiss = ZeissExporter(zeiss_data, zeiss_xml) if zeiss_data is not None else None
+        self.workers = workers
+        # error of each file or Zeiss folder that could not be scanned by the last build, by path
+        self.failed = {}
+
+    def list_jobs(self):
+        jobs = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            for f in sorted(filenames):
+                if f.lower().endswith(('.e2e', '.fds')):
+                    jobs.append((self.scan_file, os.path.join(dirpath, f)))
+        if self.zeiss is not None:
+            jobs.extend((self.scan_zeiss_folder, folder) for folder in self.zeiss.data_folders)
+        return jobs
+
+    def scan_file(self, filepath):
+        filename = os.path.basename(filepath)
+        if filename.lower().endswith('.e2e'):
+            rows = E2E(filepath).scan_metadata()
+            file_format = 'e2e'
+        else:
+            with FDS(filepath) as fds:
+                rows = fds.scan_metadata()
+            file_format = 'fds'
+        if self.log.use_log:
+            patient = self.log.patient_from_filename(filename)
+            for row in rows:
+                row.update(patient_id=self.log.id_from_filename(filename), patient_surname=patient[0],
+                           patient_name=patient[1], visit_date=self.log.visit_date_from_filename(filename))
+        for row in rows:
+            row.update(filepath=filepath, format=file_format)
+        return rows
+
+    def scan_zeiss_folder(self, folder):
+        rows = self.zeiss.scan_metadata(folder)
+        for row in rows:
+            row.update(filepath=os.path.join(self.zeiss.data_root, folder), format='zeiss')
+        return rows
+
+    def build(self):
+        """
+        Scans all the files of the archive on a thread pool. A file that cannot be scanned does not stop the others,
+        and is recorded in self.failed
+        :return: DataFrame with one row per volume and the COLUMNS as columns
+        """
+        jobs = self.list_jobs()
+        rows = []
+        self.failed = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(executor.submit(function, path), path) for function, path in jobs]
+            for future, path in tqdm(futures):
+                try:
+                    file_rows = future.result()
+                except Exception as e:
+                    self.failed[path] = '{}: {}'.format(type(e).__name__, e)
+                    continue
+                num_series = len(set(row.get('series_id') for row in file_rows))
+                for row in file_rows:
+                    row['num_series'] = num_series
+                    row['eye'] = {'R': 'OD', 'L': 'OS'}.get(row.get('laterality'))
+                rows.extend(file_rows)
+        return pd.DataFrame(rows, columns=COLUMNS)
+
+
+def save_catalog(df, filepath):
+    """
+    Saves the catalog as a .csv, a pickled DataFrame (.pkl) or the volumes table of a SQLite database (.sqlite, .db)
+    """
+    extension = os.path.splitext(filepath)[1].lower()
+    if extension == '.csv':
+        df.to_csv(filepath, index=False)
+    elif extension == '.pkl':
+        df.to_pickle(filepath)
+    elif extension in ['.sqlite', '.db']:
+        with sqlite3.connect(filepath) as con:
+            df.to_sql('volumes', con, if_exists='replace', index=False)
+    else:
+        raise NotImplementedError('Saving with file extension {} not supported'.format(extension))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir", help="Folder containing the .E2E and .fds files, searched recursively")
+    parser.add_argument("-o", "--output", help="Catalog file path (.csv, .pkl, .sqlite or .db)", default="catalog.pkl")
+    parser.add_argument("-l", "--log", help="Path of the BatchLog.txt used to name the patients of .E2E files",
+                        default=None)
+    parser.add_argument("-zd", "--zeiss_data", help="Data folder of a Zeiss export", default=None)
+    parser.add_argument("-zx", "--zeiss_xml", help="XML folder of a Zeiss export", default=None)
+    parser.add_argument("-w", "--workers", help="Number of files scanned in parallel", type=int, default=8)
+    args = parser.parse_args()
+
+    builder = CatalogBuilder(args.dir, args.log, args.zeiss_data, args.zeiss_xml, args.workers)
+    catalog = builder.build()
+    save_catalog(catalog, args.output)
+    print('Cataloged %i volume(s) in %s, %i file(s) failed' % (len(catalog), args.output, len(builder.failed)))
+    for path, error in builder.failed.items():
+        print('%s: %s' % (path, error))
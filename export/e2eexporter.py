@@ -1,22 +1,80 @@
 import argparse
 import os
-from oct_converter.readers import E2E
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+import numpy as np
+from oct_converter.readers import E2E, IndexCache
+from oct_converter.readers.e2e import custom_float_table
 from tqdm import tqdm
-from oct_converter.image_types import FundusImageWithMetaData
+from oct_converter.image_types import FundusImageWithMetaData, save_slices
+from oct_converter.image_types.oct import IMAGE_TYPES, VOLUME_TYPES
+from manifest import ExportManifest
+from pipeline import Pipeline, Stage, image_stages, format_stats
+from planner import calibrate, estimated_formats, summarize, format_plan
+
+
+# name of an .e2e file mentioned in a line of a log, possibly as part of its path
+LOGGED_FILENAME = re.compile(r'[^\s\\/:"\',;]+\.e2e\b', re.IGNORECASE)
 
 
 class LogProcessor:
     def __init__(self, filepath):
+        """
+        :param filepath: Path of a BatchLog.txt, or list of paths of logs merged together, in which case the first line
+        mentioning a file is used. None to not use any log
+        """
+        filepaths = [filepath] if isinstance(filepath, str) else filepath
         self.use_log = filepath is not None
         if self.use_log:
-            assert os.path.exists(filepath)
-            with open(filepath) as fp:
-                self.log = fp.readlines()
+            self.log = []
+            for path in filepaths:
+                assert os.path.exists(path)
+                with open(path) as fp:
+                    self.log.extend(fp.readlines())
+            self.index = self.build_index()
+            self.entries = {}
 
-    def get_log_index(self, key):
+    def build_index(self):
+        """
+        Indexes the log in a single pass
+        :return: Position of the first line mentioning each file, by lowercase file name
+        """
+        index = {}
         for i, line in enumerate(self.log):
-            if key.lower() in line.lower():
-                return i
+            for filename in LOGGED_FILENAME.findall(line):
+                index.setdefault(filename.lower(), i)
+        return index
+
+    def get_log_index(self, key):
+        key = key.lower()
+        if key not in self.index:
+            # not a whole file name of the log, searched once in its lines, as a substring
+            self.index[key] = next((i for i, line in enumerate(self.log) if key in line.lower()), None)
+        return self.index[key]
+
+    def entry(self, filename):
+        """
+        Patient, id and visit date of a file, parsed once from its line of the log
+        :return: dict with the 'patient' [surname, name], 'id' and 'visit_date' of the file
+        """
+        index = self.get_log_index(filename)
+        if index is None:
+            raise KeyError('%s not found in the log' % filename)
+        if index not in self.entries:
+            self.entries[index] = {'patient': self.extract_patient_name(index),
+                                   'id': self.extract_patient_id(index),
+                                   'visit_date': self.extract_visit_date(index)}
+        return self.entries[index]
+
+    def missing_files(self, filenames):
+        """
+        :return: The files that are not mentioned in the log
+        """
+        if not self.use_log:
+            return []
+        return [f for f in filenames if self.get_log_index(f) is None]
 
     def extract_patient_name(self, index):
         line = self.log[index]
@@ -31,13 +89,13 @@ class LogProcessor:
 
     def patient_from_filename(self, filename):
         if self.use_log:
-            return self.extract_patient_name(self.get_log_index(filename))
+            return self.entry(filename)['patient']
         else:
             return ['', '']
 
     def visit_date_from_filename(self, filename):
         if self.use_log:
-            return self.extract_visit_date(self.get_log_index(filename))
+            return self.entry(filename)['visit_date']
         else:
             return ''
 
@@ -48,11 +106,19 @@ class LogProcessor:
 
     def id_from_filename(self, filename):
         if self.use_log:
-            return self.extract_patient_id(self.get_log_index(filename))
+            return self.entry(filename)['id']
         else:
             return ''
 
 
+def parse_slice(text):
+    """ Parses a START:STOP slice range given on the command line, either bound being optional. """
+    bounds = [int(bound) if bound else None for bound in text.split(':')]
+    if len(bounds) == 1:
+        return slice(bounds[0], bounds[0] + 1)
+    return slice(*bounds)
+
+
 class E2EExporter:
     def __init__(self, config):
 
@@ -60,17 +126,26 @@ class E2EExporter:
         log_filepath = config['input']['spectralis_log_filename']
 
         if log_filepath is not None:
-            log_filepath = os.path.split()
-            if not log_filepath[0]:
-                log_filepath = os.path.join(e2e_dirpath[0], log_filepath[1])
-            else:
-                log_filepath = config['input']['spectralis_log_filename']
+            # logs given by name only are looked for next to the .e2e files
+            log_filepath = [path if os.path.split(path)[0] else os.path.join(e2e_dirpath[0], path)
+                            for path in ([log_filepath] if isinstance(log_filepath, str) else log_filepath)]
 
         self.log = LogProcessor(log_filepath)
+        self.filters = config.get('filters', {})
+        index_cache_folder = config['input'].get('index_cache')
+        self.index_cache = IndexCache(index_cache_folder) if index_cache_folder else None
         self.dirpath = e2e_dirpath[0]
         self.output = config['export']['output_folder']
         self.overwrite = config['export']['overwrite']
         self.format = config['export']['format']
+        self.save_workers = config['export'].get('save_workers', 1)
+        self.png_compression = config['export'].get('png_compression')
+        self.workers = config['options'].get('workers', 1)
+        # number of threads of the read, decode, encode and write stages, see export_pipelined
+        self.pipeline = config['options'].get('pipeline')
+        self.queue_size = config['options'].get('queue_size', 8)
+        self.manifest = config['export'].get('manifest')
+        self.manifest_hash = config['export'].get('manifest_hash', False)
         if not self.format[0] == '.':
             self.format = '.'+self.format
         if e2e_dirpath[1]:
@@ -81,41 +156,384 @@ class E2EExporter:
         if config['options']['verbose']:
             print('Found %i .e2e file(s)' % len(self.files))
 
+    def output_folder(self, filename):
+        """ Folder the volumes of a file are exported to: its patient and visit folder, or one named after the file
+        when no log is used. """
+        if self.log.use_log:
+            patient = self.log.patient_from_filename(filename)
+            patient_id = self.log.id_from_filename(filename)
+            visit_date = self.log.visit_date_from_filename(filename).replace('/', '-')
+            return os.path.join(self.output, str(patient_id)+' '+patient[0]+', '+patient[1]+'/'+visit_date+'/')
+        file, ext = os.path.splitext(os.path.basename(filename))
+        return os.path.join(self.output, file)
+
+    def plan(self, manifest=None):
+        """
+        Decides which files are exported, before any of them is: a file is skipped when its folder already exists,
+        or is the folder of a file before it, unless overwriting, and when it is missing from the log.
+        With a manifest, a file is instead skipped when its export completed and it did not change since, or when its
+        folder is the one of another completed file or of a file before it, whether overwriting or not
+        :param manifest: ExportManifest of the previous exports
+        :return: list of (filename, folder) to export, list of (filename, folder) skipped, list of files missing
+        from the log
+        """
+        jobs, skipped = [], []
+        claimed = set()
+        exported_folders = manifest.folders() if manifest is not None else {}
+        files = [f for f in self.files if f.lower().endswith('.e2e')]
+        missing = self.log.missing_files(files)
+        not_logged = set(missing)
+        for f in files:
+            if f in not_logged:
+                continue
+            folder = self.output_folder(f)
+            key = os.path.normpath(folder)
+            source = os.path.abspath(os.path.join(self.dirpath, f))
+            if manifest is not None:
+                skip = key in claimed or manifest.status(source) == 'complete' or \
+                       exported_folders.get(key, source) != source
+            else:
+                skip = not self.overwrite and (os.path.exists(folder) or key in claimed)
+            if skip:
+                skipped.append((f, folder))
+            else:
+                jobs.append((f, folder))
+            claimed.add(key)
+        return jobs, skipped, missing
+
     def export(self):
-        for i, f in tqdm(enumerate(self.files)):
-            if f.lower().endswith('.e2e'):
-                patient = self.log.patient_from_filename(f)
-                patient_id = self.log.id_from_filename(f)
-                visit_date = self.log.visit_date_from_filename(f).replace('/', '-')
-                if self.log.use_log:
-                    folder = os.path.join(self.output, str(patient_id)+' '+patient[0]+', '+patient[1]+'/'+visit_date+'/')
-                else:
-                    base = os.path.basename(f)
-                    file, ext = os.path.splitext(base)
-                    folder = os.path.join(self.output, file)
-                if os.path.exists(folder) and not self.overwrite:
-                    print('Skipping folder %s'%folder)
+        """
+        Exports all the files, through the stages of export_pipelined when exporting to images with a pipeline
+        configured, else in a pool of self.workers processes if more than one. A file that fails does not stop the
+        others
+        :return: Report of the export, a dict with the 'exported', 'skipped', 'missing' (from the log) and 'failed'
+        files, the latter mapped to their error, and the 'stats' of the pipeline's stages if used
+        """
+        manifest = ExportManifest(self.manifest, self.manifest_hash) if self.manifest is not None else None
+        try:
+            jobs, skipped, missing = self.plan(manifest)
+            for f, folder in skipped:
+                print('Skipping folder %s' % folder)
+            for f in missing:
+                print('Skipping %s, not found in the log' % f)
+            report = {'exported': [], 'skipped': [f for f, folder in skipped], 'missing': missing, 'failed': {}}
+            if manifest is not None:
+                # files left as started are exported again by the next run
+                for f, folder in jobs:
+                    manifest.start(os.path.join(self.dirpath, f), folder)
+            # the files of a folder are exported in order by a single worker, so that they never write the same
+            # paths at the same time and the last one wins as when exporting serially
+            groups = group_by_folder(jobs)
+            if self.pipeline is not None and self.format.lower() in IMAGE_TYPES:
+                report['stats'] = self.export_pipelined(groups, report, manifest)
+                print(format_stats(report['stats']))
+            elif self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor, tqdm(total=len(jobs)) as progress:
+                    futures = {executor.submit(export_folder, self.folder_jobs(group), self.export_options()): group
+                               for group in groups}
+                    for future in as_completed(futures):
+                        group = futures[future]
+                        try:
+                            results = future.result()
+                        except Exception as e:
+                            # the worker itself failed, e.g. it was killed
+                            results = [(None, '{}: {}'.format(type(e).__name__, e))] * len(group)
+                        self._record(report, manifest, group, results)
+                        progress.update(len(group))
+            else:
+                for group in tqdm(groups):
+                    self._record(report, manifest, group, export_folder(self.folder_jobs(group),
+                                                                        self.export_options()))
+        finally:
+            if manifest is not None:
+                manifest.close()
+        return report
+
+    def estimate(self, sample=2, slices_per_volume=3):
+        """
+        Plans the export without writing anything: reads the headers of the files that would be exported, see plan,
+        and times the export of a few b-scans of the first ones, encoded in memory
+        :param sample: Number of files the throughput is measured on
+        :param slices_per_volume: Number of b-scans of each volume of the sample exported
+        :return: Totals of the export per patient folder and overall, see planner.summarize, along with the files
+        'skipped', 'missing' from the log and that could not be read ('failed')
+        """
+        manifest = None
+        if self.manifest is not None and os.path.exists(self.manifest):
+            manifest = ExportManifest(self.manifest, self.manifest_hash)
+        try:
+            jobs, skipped, missing = self.plan(manifest)
+        finally:
+            if manifest is not None:
+                manifest.close()
+        rows, failed = [], {}
+        for f, folder in tqdm(jobs):
+            try:
+                volumes = E2E(os.path.join(self.dirpath, f), index_cache=self.index_cache).list_volumes(
+                    **{key: value for key, value in self.filters.items() if key != 'slices'})
+            except Exception as e:
+                failed[f] = '{}: {}'.format(type(e).__name__, e)
+                continue
+            patient = os.path.relpath(folder, self.output).split(os.sep)[0]
+            for volume in volumes:
+                num_slices = volume['num_slices']
+                if volume['type'] == 'oct' and self.filters.get('slices') is not None:
+                    num_slices = len(range(num_slices)[self.filters['slices']])
+                rows.append({'patient': patient, 'source': f, 'num_slices': num_slices,
+                             'height': volume['height'], 'width': volume['width']})
+        sampled = [f for f, folder in jobs if f not in failed][:sample]
+        formats = estimated_formats(self.format)
+        # b-scans are saved as 8 bits in volume files, as float64 otherwise
+        dtypes = {f: np.uint8 if f.lower() in VOLUME_TYPES else np.float64 for f in formats}
+        seconds_per_pixel, bytes_per_pixel = calibrate(self._sample_images(sampled, slices_per_volume), formats,
+                                                       self.png_compression, dtypes)
+        workers = self.workers if self.pipeline is None else min(self.pipeline.values())
+        summary = summarize(rows, seconds_per_pixel, bytes_per_pixel, workers)
+        summary.update(skipped=[f for f, folder in skipped], missing=missing, failed=failed)
+        return summary
+
+    def _sample_images(self, filenames, slices_per_volume):
+        """ Reads and decodes the fundus images and first b-scans of each volume of the files, as exported """
+        dtype = np.uint8 if self.format.lower() in VOLUME_TYPES else np.float64
+        table = custom_float_table(dtype)
+        filters = {key: value for key, value in self.filters.items() if key != 'slices'}
+        for f in filenames:
+            file = E2E(os.path.join(self.dirpath, f), index_cache=self.index_cache)
+            for volume in file.list_volumes(**filters):
+                if volume['type'] == 'fundus':
+                    yield file.read_fundus(volume['key']).image
                     continue
-                file = E2E(os.path.join(self.dirpath, f))
-                oct_volumes = file.read_oct_volume()  # returns an OCT volume with additional metadata if available
-                for o in oct_volumes:
-                    laterality = 'OD' if o.laterality == 'R' else 'OS'
+                bscans = file.iter_raw_slices(volume['key'], self.filters.get('slices'))
+                for position, words in islice(bscans, slices_per_volume):
+                    yield np.take(table, words)
+                bscans.close()
 
-                    f_save = os.path.join(folder, laterality, o.type)
-                    f_save_data = os.path.join(f_save, 'data/')
-                    if not os.path.exists(f_save):
-                        os.makedirs(f_save)
+    def _record(self, report, manifest, group, results):
+        """ Records the outcome of the export of each file of a group in the report and manifest, see export_folder """
+        for (filename, folder), (outputs, error) in zip(group, results):
+            if error is not None:
+                report['failed'][filename] = error
+                continue
+            report['exported'].append(filename)
+            if manifest is not None:
+                manifest.complete(os.path.join(self.dirpath, filename), outputs)
 
-                    if not os.path.exists(f_save_data):
-                        os.makedirs(f_save_data)
-                    o.save(os.path.join(f_save_data, 'data'+self.format))
-                    img_type = 'fundus' if isinstance(o, FundusImageWithMetaData) else 'OCT'
+    def log_entry(self, filename):
+        """
+        :return: dict with the 'patient' [surname, name], 'id' and 'visit_date' of a file, empty without a log
+        """
+        return {'patient': self.log.patient_from_filename(filename),
+                'id': self.log.id_from_filename(filename),
+                'visit_date': self.log.visit_date_from_filename(filename).replace('/', '-')}
 
-                    meta = {'visit_date': visit_date, 'laterality': laterality,
-                           'patient': patient, 'image_type':img_type}
-                    with open(os.path.join(f_save,'metadata.csv'), 'w') as f:
-                        for key in meta.keys():
-                            f.write("%s,%s\n" % (key, meta[key]))
+    def export_options(self):
+        """ Options of export_e2e, small enough to be sent to a worker process with each folder """
+        return {'format': self.format, 'filters': self.filters, 'index_cache': self.index_cache,
+                'save_workers': self.save_workers, 'png_compression': self.png_compression}
+
+    def folder_jobs(self, group):
+        """
+        :param group: list of (filename, folder), see group_by_folder
+        :return: list of (path of the file, folder, log entry), see export_folder
+        """
+        return [(os.path.join(self.dirpath, f), folder, self.log_entry(f)) for f, folder in group]
+
+    def export_pipelined(self, groups, report, manifest=None):
+        """
+        Exports files through four stages running concurrently, each on its own threads and connected by bounded
+        queues: reading the undecoded b-scans and fundus images, decoding the b-scans, encoding the images and writing
+        them. A file is complete once all its images are written. See export for the report
+        :param groups: list of list of (filename, folder), see group_by_folder. The images of a file are only read
+        once those of the file before it in its group are written
+        :return: Statistics of the stages, see Pipeline.run
+        """
+        lock = threading.Lock()
+        written_images = threading.Condition(lock)
+        # images of each file not written yet, whether all its images were read, and the files it wrote
+        state = {f: {'pending': 0, 'read': False, 'outputs': []} for group in groups for f, folder in group}
+        table = custom_float_table(np.uint8)
+
+        def finish(filename):
+            # called under the lock
+            file_state = state[filename]
+            if file_state['read'] and file_state['pending'] == 0 and filename not in report['failed']:
+                report['exported'].append(filename)
+                if manifest is not None:
+                    manifest.complete(os.path.join(self.dirpath, filename), sorted(file_state['outputs']))
+
+        def fail(filename, error):
+            # called under the lock
+            report['failed'].setdefault(filename, '{}: {}'.format(type(error).__name__, error))
+
+        def read_file(filename, folder):
+            file = E2E(os.path.join(self.dirpath, filename), index_cache=self.index_cache)
+            filters = {key: value for key, value in self.filters.items() if key != 'slices'}
+            for volume in file.list_volumes(**filters):
+                data_filepath, metadata_filepath = prepare_volume(folder, volume, self.log_entry(filename),
+                                                                  self.format)
+                with lock:
+                    state[filename]['outputs'].append(metadata_filepath)
+                if volume['type'] == 'fundus':
+                    images = [(data_filepath, 'fundus', file.read_fundus(volume['key']).image)]
+                else:
+                    base = os.path.splitext(data_filepath)[0]
+                    images = (('{}_{}{}'.format(base, position, self.format), 'oct', words) for position, words
+                              in file.iter_raw_slices(volume['key'], self.filters.get('slices')))
+                for image_filepath, kind, data in images:
+                    with lock:
+                        state[filename]['pending'] += 1
+                    yield filename, image_filepath, kind, data
+
+        def read(group):
+            previous = None
+            for filename, folder in group:
+                if previous is not None:
+                    with written_images:
+                        written_images.wait_for(lambda: state[previous]['pending'] == 0)
+                previous = filename
+                try:
+                    yield from read_file(filename, folder)
+                except Exception as e:
+                    with lock:
+                        fail(filename, e)
+                with lock:
+                    state[filename]['read'] = True
+                    finish(filename)
+
+        def decode(item):
+            filename, image_filepath, kind, data = item
+            return [(filename, image_filepath, np.take(table, data) if kind == 'oct' else data)]
+
+        def written(filename, image_filepath):
+            with lock:
+                state[filename]['pending'] -= 1
+                state[filename]['outputs'].append(image_filepath)
+                finish(filename)
+                written_images.notify_all()
+
+        def failed(stage, item, error):
+            # items after the read stage start with the name of their file, and are dropped
+            with lock:
+                if stage.name == 'read':
+                    for filename, folder in item:
+                        fail(filename, error)
+                    return
+                fail(item[0], error)
+                state[item[0]]['pending'] -= 1
+                written_images.notify_all()
+
+        workers = self.pipeline
+        stages = [Stage('read', read, workers.get('read', 1), self.queue_size),
+                  Stage('decode', decode, workers.get('decode', 1), self.queue_size)]
+        stages += image_stages(self.format, self.png_compression, workers.get('encode', 1), workers.get('write', 1),
+                               self.queue_size, written)
+        return Pipeline(stages, on_error=failed).run(groups)
+
+    def export_file(self, filename, folder):
+        """
+        Exports the volumes of a single file, see export_e2e
+        :param filename: Name of the .e2e file in self.dirpath
+        :param folder: Folder the volumes are exported to, see output_folder
+        :return: Paths of the files written
+        """
+        return export_e2e(os.path.join(self.dirpath, filename), folder, self.log_entry(filename),
+                          self.export_options())
+
+
+def group_by_folder(jobs):
+    """
+    Groups the jobs exporting to the same folder, keeping their order
+    :param jobs: list of (filename, folder), see E2EExporter.plan
+    :return: list of list of (filename, folder)
+    """
+    groups = {}
+    for f, folder in jobs:
+        groups.setdefault(os.path.normpath(folder), []).append((f, folder))
+    return list(groups.values())
+
+
+def prepare_volume(folder, volume, entry, format):
+    """
+    Creates the folders of a volume and writes its metadata.csv
+    :param entry: Log entry of the file of the volume, see E2EExporter.log_entry
+    :return: Path of its data file, to which the position of each b-scan is appended when saved as images, and of
+    its metadata.csv
+    """
+    laterality = 'OD' if volume['laterality'] == 'R' else 'OS'
+    f_save = os.path.join(folder, laterality, volume['type'])
+    f_save_data = os.path.join(f_save, 'data/')
+    # exist_ok, as files of the same patient may be exported at the same time
+    os.makedirs(f_save_data, exist_ok=True)
+    img_type = 'fundus' if volume['type'] == 'fundus' else 'OCT'
+
+    meta = {'visit_date': entry['visit_date'], 'laterality': laterality,
+           'patient': entry['patient'], 'image_type':img_type}
+    metadata_filepath = os.path.join(f_save, 'metadata.csv')
+    with open(metadata_filepath, 'w') as f:
+        for key in meta.keys():
+            f.write("%s,%s\n" % (key, meta[key]))
+    return os.path.join(f_save_data, 'data'+format), metadata_filepath
+
+
+def export_e2e(filepath, folder, entry, options):
+    """
+    Exports the volumes of a single .e2e file. Runs in the worker processes when exporting in parallel, so it only
+    gets what it needs rather than the whole exporter and its log
+    :param filepath: Path of the .e2e file
+    :param folder: Folder the volumes are exported to, see E2EExporter.output_folder
+    :param entry: Log entry of the file, see E2EExporter.log_entry
+    :param options: See E2EExporter.export_options
+    :return: Paths of the files written, in the order they were written
+    """
+    outputs = []
+    patient = entry['patient']
+    export_format = options['format']
+    file = E2E(filepath, index_cache=options['index_cache'])
+    # volume files keep the 8 bits b-scans that would be written as images, instead of float64 ones
+    dtype = np.uint8 if export_format.lower() in VOLUME_TYPES else np.float64
+    # volumes are decoded and saved one b-scan at a time
+    for volume, slices in file.iter_volumes(dtype=dtype, **options['filters']):
+        data_filepath, metadata_filepath = prepare_volume(folder, volume, entry, export_format)
+        if volume['type'] == 'fundus':
+            index, image = next(slices)
+            FundusImageWithMetaData(image=image, patient_id=volume['key'],
+                                    laterality=volume['laterality']).save(data_filepath)
+            outputs.append(data_filepath)
+        else:
+            metadata = {'type': 'oct', 'laterality': volume['laterality'], 'patient_id': entry['id'],
+                        'patient_name': patient[1], 'patient_surname': patient[0],
+                        'visit_date': entry['visit_date']}
+            outputs.extend(save_slices(data_filepath, slices, volume['num_slices'], options['save_workers'],
+                                       options['png_compression'], metadata))
+        outputs.append(metadata_filepath)
+    return outputs
+
+
+def export_folder(jobs, options):
+    """
+    Exports, in order, the files of an output folder. A file that fails does not stop the others
+    :param jobs: list of (path of the file, folder, log entry), see E2EExporter.folder_jobs
+    :param options: See E2EExporter.export_options
+    :return: list of (paths of the files written, None) or (None, error) for each file
+    """
+    results = []
+    for filepath, folder, entry in jobs:
+        try:
+            results.append((export_e2e(filepath, folder, entry, options), None))
+        except Exception as e:
+            results.append((None, '{}: {}'.format(type(e).__name__, e)))
+    return results
+
+
+def write_report(report, filepath):
+    """ Writes the report of an export as a .csv, with the status of each file and the error of failed ones """
+    with open(filepath, 'w') as f:
+        f.write('file,status,error\n')
+        for status in ['exported', 'skipped', 'missing']:
+            for filename in report[status]:
+                f.write('"%s",%s,\n' % (filename, status))
+        for filename, error in report['failed'].items():
+            f.write('"%s",failed,"%s"\n' % (filename, error.replace('"', "'")))
 
 
 if __name__ == '__main__':
@@ -128,41 +546,96 @@ if __name__ == '__main__':
     parser.add_argument("-eo", "--export_in_origin_folder", help="Export in the origin folder", action="store_true",
                         default=False)
 
-    parser.add_argument("-l", "--log",
+    parser.add_argument("-l", "--log", nargs='+',
                         help="Path of the log file used to reconstruct the patient forder. \
-                        By default, I'll look in DIRPATH/BatchLog.txt", default="BatchLog.txt")
-
-    parser.add_argument("-f", "--format", help="export format", default=".png")
+                        By default, I'll look in DIRPATH/BatchLog.txt. Several logs are merged together",
+                        default=["BatchLog.txt"])
 
+    parser.add_argument("-f", "--format", help="export format, an image format or .h5 for a single compressed \
+                        volume file", default=".png")
+    parser.add_argument("-t", "--types", help="Only export these types of images", nargs='+',
+                        choices=['oct', 'fundus'], default=None)
+    parser.add_argument("-e", "--eye", help="Only export images of this eye", choices=['OD', 'OS'], default=None)
+    parser.add_argument("-s", "--series", help="Only export images of these series", nargs='+', type=int,
+                        default=None)
+    parser.add_argument("--slices", help="Only export the b-scans in this START:STOP range", type=parse_slice,
+                        default=None)
+    parser.add_argument("-ic", "--index_cache", help="Folder where the chunk index of each .E2E file is cached, \
+                        so that later runs skip the directory traversal", default=None)
+    parser.add_argument("-w", "--workers", help="Number of files exported in parallel, each by its own process",
+                        type=int, default=1)
+    parser.add_argument("-r", "--report", help="Path of a .csv report of the status of each file", default=None)
+    parser.add_argument("-m", "--manifest", help="Path of a SQLite manifest of the exports. Files whose export \
+                        completed and that did not change since are skipped, others are exported again", default=None)
+    parser.add_argument("-mh", "--manifest_hash", help="Also compare the content of the files to the manifest, not \
+                        only their size and modification time", action="store_true", default=False)
+    parser.add_argument("-sw", "--save_workers", help="Number of threads encoding and writing the b-scans",
+                        type=int, default=1)
+    parser.add_argument("-pc", "--png_compression", help="Compression level of .png files, from 0 (fastest) to 9 \
+                        (smallest)", type=int, choices=range(10), default=None)
+    parser.add_argument("-p", "--pipeline", help="Export to images through read, decode, encode and write stages \
+                        running concurrently, with these numbers of threads. Replaces --workers", nargs=4, type=int,
+                        metavar=('READ', 'DECODE', 'ENCODE', 'WRITE'), default=None)
+    parser.add_argument("--plan", help="Only report the files, volumes and b-scans that would be exported per \
+                        patient, with their estimated size and export time, without writing anything",
+                        action="store_true", default=False)
+    parser.add_argument("-ps", "--plan_sample", help="Number of files the export time and size are estimated from",
+                        type=int, default=2)
+    parser.add_argument("-qs", "--queue_size", help="Number of items waiting between two stages of the pipeline at \
+                        most", type=int, default=8)
 
     args = parser.parse_args()
     no_log = args.no_log
     export_origin_folder = args.export_in_origin_folder
     e2e_dirpath = os.path.split(args.dir)
-    log_filepath = os.path.split(args.log)
     if no_log:
         log_filepath = None
     else:
-        if not log_filepath[0]:
-            log_filepath = os.path.join(e2e_dirpath[0], log_filepath[1])
-        else:
-            log_filepath = args.log
+        log_filepath = [path if os.path.split(path)[0] else os.path.join(e2e_dirpath[0], path) for path in args.log]
 
     config = {}
     config['input'] = {}
     config['export'] = {}
     config['options'] = {}
+    config['filters'] = {}
 
     config['input']['spectralis'] = args.dir
     config['input']['spectralis_log_filename'] = log_filepath
+    config['input']['index_cache'] = args.index_cache
     config['export']['format'] = args.format
     if export_origin_folder:
         config['export']['output_folder'] = os.path.split(args.dir)[0]
     else:
         config['export']['output_folder'] = args.output
     config['export']['overwrite'] = args.overwrite
+    config['export']['save_workers'] = args.save_workers
+    config['export']['png_compression'] = args.png_compression
+    config['export']['manifest'] = args.manifest
+    config['export']['manifest_hash'] = args.manifest_hash
     config['options']['verbose'] = args.verbosity
+    config['options']['workers'] = args.workers
+    if args.pipeline is not None:
+        config['options']['pipeline'] = dict(zip(['read', 'decode', 'encode', 'write'], args.pipeline))
+    config['options']['queue_size'] = args.queue_size
+    config['filters']['types'] = args.types
+    config['filters']['laterality'] = {'OD': 'R', 'OS': 'L', None: None}[args.eye]
+    config['filters']['series'] = args.series
+    config['filters']['slices'] = args.slices
 
     e = E2EExporter(config)
 
-    e.export()
+    if args.plan:
+        summary = e.estimate(args.plan_sample)
+        print(format_plan(summary))
+        print('%i file(s) skipped, %i missing from the log, %i unreadable' % (
+            len(summary['skipped']), len(summary['missing']), len(summary['failed'])))
+        for filename, error in summary['failed'].items():
+            print('%s: %s' % (filename, error))
+    else:
+        report = e.export()
+        print('Exported %i file(s), skipped %i, %i missing from the log, %i failed' % (
+            len(report['exported']), len(report['skipped']), len(report['missing']), len(report['failed'])))
+        for filename, error in report['failed'].items():
+            print('%s: %s' % (filename, error))
+        if args.report is not None:
+            write_report(report, args.report)
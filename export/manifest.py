@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+STARTED = 'started'
+COMPLETE = 'complete'
+
+
+def file_digest(filepath, block_size=1 << 20):
+    """ sha1 of the content of a file """
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ExportManifest:
+    """
+    Persistent record of the exported sources, as a SQLite database with one row per source: its size, modification
+    time and optionally content hash when exported, the folder and files it was exported to, and whether its export
+    completed. A source is only exported again when it is new, changed or its export did not complete
+    """
+    def __init__(self, filepath, use_hash=False):
+        """
+        :param filepath: Path of the database, created if needed
+        :param use_hash: Also record the sha1 of the sources, so that a source whose modification time changed but not
+        its content is not exported again
+        """
+        self.filepath = filepath
+        self.use_hash = use_hash
+        # the pipelined export records completed files from its threads, one at a time
+        self.con = sqlite3.connect(filepath, check_same_thread=False)
+        self.con.execute('CREATE TABLE IF NOT EXISTS exports (source TEXT PRIMARY KEY, size INTEGER, '
+                         'mtime_ns INTEGER, hash TEXT, folder TEXT, outputs TEXT, state TEXT, updated REAL)')
+        self.con.commit()
+        self.entries = {row[0]: row[1:] for row in
+                        self.con.execute('SELECT source, size, mtime_ns, hash, folder, state FROM exports')}
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def status(self, source):
+        """
+        :return: 'new', 'changed', 'incomplete' or 'complete'
+        """
+        source = os.path.abspath(source)
+        if source not in self.entries:
+            return 'new'
+        size, mtime_ns, digest, folder, state = self.entries[source]
+        stat = os.stat(source)
+        if stat.st_size != size:
+            return 'changed'
+        if stat.st_mtime_ns != mtime_ns and not (self.use_hash and digest == file_digest(source)):
+            return 'changed'
+        return 'complete' if state == COMPLETE else 'incomplete'
+
+    def folders(self):
+        """
+        :return: Source of the completed export of each output folder, by normalized folder path
+        """
+        return {os.path.normpath(folder): source for source, (size, mtime_ns, digest, folder, state)
+                in self.entries.items() if state == COMPLETE}
+
+    def start(self, source, folder):
+        """ Records that the export of a source into a folder started, with the current state of the source """
+        source = os.path.abspath(source)
+        stat = os.stat(source)
+        digest = file_digest(source) if self.use_hash else None
+        self.entries[source] = (stat.st_size, stat.st_mtime_ns, digest, folder, STARTED)
+        self.con.execute('INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                         (source, stat.st_size, stat.st_mtime_ns, digest, folder, '[]', STARTED, time.time()))
+        self.con.commit()
+
+    def complete(self, source, outputs):
+        """ Records that the export of a source completed, and the files it wrote """
+        source = os.path.abspath(source)
+        self.entries[source] = self.entries[source][:4] + (COMPLETE,)
+        self.con.execute('UPDATE exports SET outputs = ?, state = ?, updated = ? WHERE source = ?',
+                         (json.dumps(outputs), COMPLETE, time.time(), source))
+        self.con.commit()
+
+    def outputs(self, source):
+        """
+        :return: Files written by the export of a source
+        """
+        row = self.con.execute('SELECT outputs FROM exports WHERE source = ?', (os.path.abspath(source),)).fetchone()
+        return json.loads(row[0]) if row else []
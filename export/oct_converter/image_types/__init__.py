@@ -1,2 +1,3 @@
-from .oct import OCTVolumeWithMetaData
-from .fundus import FundusImageWithMetaData
\ No newline at end of file
+from .oct import OCTVolumeWithMetaData, save_slices, write_images, write_hdf5
+from .fundus import FundusImageWithMetaData
+from .montage import montage, montage_indices
@@ -1,16 +1,19 @@
 import os
-import imageio
-import cv2
-import matplotlib.pyplot as plt
 import numpy as np
+from .oct import VOLUME_TYPES, write_hdf5
+from .montage import montage
+from .shared import SharedMemoryMixin
 
 VIDEO_TYPES = ['.avi', '.mp4', ]
 IMAGE_TYPES = ['.png', '.bmp', '.tiff', '.jpg', '.jpeg']
 
 
-class FundusImageWithMetaData(object):
+class FundusImageWithMetaData(SharedMemoryMixin):
     """ Class to hold the fundus image and any related metadata, and enable saving.
 
+    Notes:
+        The image can be held in shared memory, see SharedMemoryMixin.
+
     Attributes:
         image (np.array): Fundus image.
         laterality (str): Left or right eye.
@@ -18,6 +21,8 @@ class FundusImageWithMetaData(object):
         DOB (str): Patient date of birth.
     """
 
+    shared_field = 'image'
+
     def __init__(self, image, laterality=None, patient_id=None, patient_dob=None,
                  patient_name='', patient_surname=''):
         self.image = image
@@ -32,35 +37,47 @@ class FundusImageWithMetaData(object):
         """Saves fundus image.
 
         Args:
-            filepath (str): Location to save volume to. Extension must be in IMAGE_TYPES.
+            filepath (str): Location to save volume to. Extension must be in IMAGE_TYPES or VOLUME_TYPES, or be .npy.
+                A volume file holds the image as its single slice.
         """
         extension = os.path.splitext(filepath)[1]
         if extension.lower() in IMAGE_TYPES:
+            import cv2
             cv2.imwrite(filepath, self.image)
         elif extension.lower() == '.npy':
             np.save(filepath, self.image)
+        elif extension.lower() in VOLUME_TYPES:
+            metadata = {'type': self.type, 'laterality': self.laterality, 'patient_id': self.patient_id,
+                        'patient_dob': self.DOB, 'patient_name': self.patient_name,
+                        'patient_surname': self.patient_surname}
+            write_hdf5(filepath, [(0, self.image)], 1, metadata)
         else:
             raise NotImplementedError('Saving with file extension {} not supported'.format(extension))
 
+    def thumbnail(self, width=512):
+        """ Downsamples the fundus image, without any plotting backend.
+
+        Args:
+            width (int): Width of the thumbnail. Its height keeps the aspect ratio of the image.
+
+        Returns:
+            np.array: 8 bits thumbnail.
+        """
+        return montage([self.image], 1, width)
+
     def peek(self, filepath=None):
-        """ Plots a montage of the OCT volume. Optionally saves the plot if a filepath is provided.
+        """ Plots the fundus image. Optionally saves a thumbnail of it if a filepath is provided.
 
         Args:
-            rows (int) : Number of rows in the plot.
-            cols (int) : Number of columns in the plot.
-            filepath (str): Location to save montage to.
+            filepath (str): Location to save thumbnail to, written without any plotting backend.
         """
-        images = 1
-        x_size = self.image.shape[0]
-        y_size = self.image.shape[1]
-        ratio = y_size / x_size
-        plt.figure(figsize=(12*ratio,12))
-        for i in range(images):
+        if filepath is not None:
+            import cv2
+            cv2.imwrite(filepath, self.thumbnail())
+        else:
+            import matplotlib.pyplot as plt
+            plt.figure(figsize=(12 * self.image.shape[1] / self.image.shape[0], 12))
             plt.imshow(self.image, cmap='gray')
             plt.axis('off')
             plt.title('Patient '+self.patient_name.upper()+' '+self.patient_surname)
-
-        if filepath is not None:
-            plt.savefig(filepath)
-        else:
             plt.show()
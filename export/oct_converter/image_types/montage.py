@@ -0,0 +1,45 @@
+import math
+import numpy as np
+
+
+def montage_indices(num_slices, count):
+    """ Positions of count b-scans evenly spread over a volume of num_slices b-scans. """
+    return np.linspace(0, num_slices - 1, count).astype(int)
+
+
+def to_uint8(image):
+    """ Converts an image to 8 bits, saturating floating point values as cv2.imwrite does and keeping the most
+    significant bits of wider integers. """
+    if image.dtype == np.uint8:
+        return image
+    if np.issubdtype(image.dtype, np.floating):
+        return np.clip(np.rint(image), 0, 255).astype(np.uint8)
+    return (image >> (8 * image.dtype.itemsize - 8)).astype(np.uint8)
+
+
+def montage(images, cols, tile_width=128):
+    """ Downsamples images and tiles them, in rows of cols images, into a single 8 bits image.
+
+    Args:
+        images (list of np.array): Images of the same shape, grayscale or colour.
+        cols (int): Number of images per row.
+        tile_width (int): Width of each image in the montage. Its height keeps the aspect ratio of the images.
+
+    Returns:
+        np.array
+
+    Raises:
+        ValueError: If there is no image.
+    """
+    if len(images) == 0:
+        raise ValueError('No image to build a montage from')
+    import cv2
+    height, width = images[0].shape[:2]
+    tile_height = max(1, int(round(height * tile_width / width)))
+    rows = int(math.ceil(len(images) / cols))
+    out = np.zeros((rows * tile_height, cols * tile_width) + images[0].shape[2:], dtype=np.uint8)
+    for i, image in enumerate(images):
+        row, col = divmod(i, cols)
+        tile = cv2.resize(image, (tile_width, tile_height), interpolation=cv2.INTER_AREA)
+        out[row * tile_height:(row + 1) * tile_height, col * tile_width:(col + 1) * tile_width] = to_uint8(tile)
+    return out
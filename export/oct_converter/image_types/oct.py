@@ -1,27 +1,54 @@
 import os
-import imageio
-import cv2
-import matplotlib.pyplot as plt
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
+from .montage import montage, montage_indices
+from .shared import SharedMemoryMixin, allocate_shared
+
+# cv2, imageio, matplotlib and h5py are imported by the code using them, as importing them all takes most of the
+# start up time of the exporters, which only need some of them
 
 VIDEO_TYPES = ['.avi', '.mp4', ]
 IMAGE_TYPES = ['.png', '.bmp', '.tiff', '.jpg', '.jpeg']
+VOLUME_TYPES = ['.h5', '.hdf5']
 
 
-class OCTVolumeWithMetaData(object):
+class OCTVolumeWithMetaData(SharedMemoryMixin):
     """ Class to hold the OCT volume and any related metadata, and enable viewing and saving.
 
+    Notes:
+        The b-scans are held in a single (num_slices, height, width) array, which can still be indexed and iterated
+        over like a list of b-scans. The array can be held in shared memory, see SharedMemoryMixin.
+
     Attributes:
-        volume (list of np.array): All the volume's b-scans.
+        volume (np.array): All the volume's b-scans.
+        missing (np.array): Mask of the b-scans that were not read, and are left as zeros in volume.
         laterality (str): Left or right eye.
         patient_id (str): Patient ID.
         DOB (str): Patient date of birth.
         num_slices: Number of b-scans present in volume.
     """
 
+    shared_field = 'volume'
+
     def __init__(self, volume, laterality=None, patient_id=None, patient_dob=None,
-                 patient_name='', patient_surname=''):
-        self.volume = volume
+                 patient_name='', patient_surname='', missing=None, dtype=None):
+        """
+        Args:
+            volume (np.array or list of np.array): B-scans of the volume. In a list, missing b-scans can be left as 0.
+            missing (np.array): Mask of the missing b-scans of an array volume. None if no b-scan is missing.
+            dtype (np.dtype): Type to convert the b-scans to. Kept as is if None.
+        """
+        if isinstance(volume, np.ndarray):
+            self.volume = volume if dtype is None else volume.astype(dtype, copy=False)
+            self.missing = np.zeros(len(volume), dtype=bool) if missing is None else np.asarray(missing, dtype=bool)
+        else:
+            self.missing = np.array([not isinstance(slice, np.ndarray) for slice in volume], dtype=bool)
+            if self.missing.all():
+                raise ValueError('Cannot infer the shape of a volume without any b-scan')
+            first = volume[int(np.argmin(self.missing))]
+            self.volume = np.zeros((len(volume),) + first.shape, dtype=first.dtype if dtype is None else dtype)
+            for index in np.flatnonzero(~self.missing):
+                self.volume[index] = volume[index]
         self.laterality = laterality
         self.patient_id = patient_id
         self.DOB = patient_dob
@@ -30,54 +57,226 @@ class OCTVolumeWithMetaData(object):
         self.patient_surname = patient_surname
         self.type = 'oct'
 
+    @classmethod
+    def empty(cls, num_slices, shape, dtype=np.float64, shared=False, **kwargs):
+        """ Preallocates a volume with all its b-scans missing, to be filled in with set_slice.
+
+        Args:
+            num_slices (int): Number of b-scans of the volume.
+            shape (tuple): Shape of each b-scan.
+            dtype (np.dtype): Type of the b-scans.
+            shared (bool): Allocate the b-scans in a shared memory block, owned by this process.
+            kwargs: Metadata, as taken by __init__.
+
+        Returns:
+            obj:OCTVolumeWithMetaData
+        """
+        shape = (num_slices,) + tuple(shape)
+        shm, volume = allocate_shared(shape, dtype) if shared else (None, np.zeros(shape, dtype=dtype))
+        oct_volume = cls(volume, missing=np.ones(num_slices, dtype=bool), **kwargs)
+        if shared:
+            oct_volume._shm = shm
+            oct_volume._owner = True
+        return oct_volume
+
+    def set_slice(self, index, image):
+        """ Copies a b-scan into the volume. """
+        self.volume[index] = image
+        self.missing[index] = False
+
+    def thumbnail(self, rows=5, cols=5, tile_width=128):
+        """ Builds a montage of rows * cols b-scans evenly spread over the volume, without any plotting backend.
+
+        Args:
+            rows (int) : Number of rows in the montage.
+            cols (int) : Number of columns in the montage.
+            tile_width (int): Width of each b-scan in the montage.
+
+        Returns:
+            np.array: 8 bits montage.
+
+        Raises:
+            ValueError: If every b-scan of the volume is missing.
+        """
+        present = np.flatnonzero(~self.missing)
+        if len(present) == 0:
+            raise ValueError('OCT volume has no b-scan to build a thumbnail from')
+        indices = present[montage_indices(len(present), min(rows * cols, len(present)))]
+        return montage([self.volume[index] for index in indices], cols, tile_width)
+
     def peek(self, rows=5, cols=5, filepath=None):
-        """ Plots a montage of the OCT volume. Optionally saves the plot if a filepath is provided.
+        """ Plots a montage of the OCT volume. Optionally saves the montage if a filepath is provided.
 
         Args:
             rows (int) : Number of rows in the plot.
             cols (int) : Number of columns in the plot.
-            filepath (str): Location to save montage to.
+            filepath (str): Location to save montage to, written without any plotting backend.
         """
-        images = rows * cols
-        x_size = rows * self.volume[0].shape[0]
-        y_size = cols * self.volume[0].shape[1]
-        ratio = y_size / x_size
-        slices_indices = np.linspace(0, self.num_slices - 1, images).astype(np.int)
-        plt.figure(figsize=(12*ratio,12))
-        for i in range(images):
-            plt.subplot(rows, cols, i +1)
-            plt.imshow(self.volume[slices_indices[i]],cmap='gray')
-            plt.axis('off')
-            plt.title('{}'.format(slices_indices[i]))
-        plt.suptitle('OCT volume '+self.laterality+' with {} slices.'.format(self.num_slices))
-
+        image = self.thumbnail(rows, cols)
         if filepath is not None:
-            plt.savefig(filepath)
+            import cv2
+            cv2.imwrite(filepath, image)
         else:
+            import matplotlib.pyplot as plt
+            plt.figure(figsize=(12 * image.shape[1] / image.shape[0], 12))
+            plt.imshow(image, cmap='gray')
+            plt.axis('off')
+            plt.title('OCT volume {} with {} slices.'.format(self.laterality, self.num_slices))
             plt.show()
 
-    def save(self, filepath):
-        """Saves OCT volume as a video or stack of slices.
+    def save(self, filepath, workers=1, png_compression=None):
+        """Saves OCT volume as a video or stack of slices. Missing b-scans are skipped, except in .npy arrays.
 
         Args:
-            filepath (str): Location to save volume to. Extension must be in VIDEO_TYPES or IMAGE_TYPES.
+            filepath (str): Location to save volume to. Extension must be in VIDEO_TYPES, IMAGE_TYPES or
+                VOLUME_TYPES, or be .npy.
+            workers (int): Number of threads writing a stack of slices, see write_images.
+            png_compression (int): Compression level of .png slices, see write_images.
+
+        Returns:
+            list of str: Paths of the files written.
         """
-        extension = os.path.splitext(filepath)[1]
-        if extension.lower() in VIDEO_TYPES:
-            video_writer = imageio.get_writer(filepath, macro_block_size=None)
-            for slice in self.volume:
-                video_writer.append_data(slice)
-            video_writer.close()
-        elif extension.lower() in IMAGE_TYPES:
-            base = os.path.splitext(os.path.basename(filepath))[0]
-            print('Saving OCT as sequential slices {}_[1..{}]{}'.format(base, len(self.volume), extension))
-            full_base = os.path.splitext(filepath)[0]
-            for index, slice in enumerate(self.volume):
-                filename = '{}_{}{}'.format(full_base, index, extension)
-                cv2.imwrite(filename, slice)
-        elif extension.lower() == '.npy':
+        if os.path.splitext(filepath)[1].lower() == '.npy':
             np.save(filepath, self.volume)
+            return [filepath]
         else:
-            raise NotImplementedError('Saving with file extension {} not supported'.format(extension))
+            slices = ((index, self.volume[index]) for index in np.flatnonzero(~self.missing))
+            metadata = {'type': self.type, 'laterality': self.laterality, 'patient_id': self.patient_id,
+                        'patient_dob': self.DOB, 'patient_name': self.patient_name,
+                        'patient_surname': self.patient_surname}
+            return save_slices(filepath, slices, self.num_slices, workers, png_compression, metadata)
+
+
+def save_slices(filepath, slices, num_slices, workers=1, png_compression=None, metadata=None):
+    """Saves b-scans one by one as they are produced, as a video, stack of slices or volume file.
+
+    Args:
+        filepath (str): Location to save volume to. Extension must be in VIDEO_TYPES, IMAGE_TYPES or VOLUME_TYPES,
+            or be .npy.
+        slices (iterable of (int, np.array)): Position in the volume and data of each b-scan.
+        num_slices (int): Number of b-scans in the volume.
+        workers (int): Number of threads writing a stack of slices, see write_images.
+        png_compression (int): Compression level of .png slices, see write_images.
+        metadata (dict): Metadata stored alongside the b-scans in a volume file, see write_hdf5.
+
+    Returns:
+        list of str: Paths of the files written.
+    """
+    extension = os.path.splitext(filepath)[1]
+    if extension.lower() in VIDEO_TYPES:
+        import imageio
+        video_writer = imageio.get_writer(filepath, macro_block_size=None)
+        for index, slice in slices:
+            video_writer.append_data(slice)
+        video_writer.close()
+        return [filepath]
+    elif extension.lower() in IMAGE_TYPES:
+        base = os.path.splitext(os.path.basename(filepath))[0]
+        print('Saving OCT as sequential slices {}_[1..{}]{}'.format(base, num_slices, extension))
+        full_base = os.path.splitext(filepath)[0]
+        images = (('{}_{}{}'.format(full_base, index, extension), slice) for index, slice in slices)
+        return write_images(images, workers, png_compression)
+    elif extension.lower() == '.npy':
+        volume = None
+        for index, slice in slices:
+            if volume is None:
+                volume = np.lib.format.open_memmap(filepath, mode='w+', dtype=slice.dtype,
+                                                   shape=(num_slices,) + slice.shape)
+            volume[index] = slice
+        if volume is None:
+            return []
+        volume.flush()
+        return [filepath]
+    elif extension.lower() in VOLUME_TYPES:
+        return write_hdf5(filepath, slices, num_slices, metadata)
+    else:
+        raise NotImplementedError('Saving with file extension {} not supported'.format(extension))
+
+
+def write_hdf5(filepath, slices, num_slices, metadata=None, compression=4):
+    """Saves b-scans one by one as they are produced, into a single chunked and compressed HDF5 file.
+
+    Notes:
+        The b-scans are stored in the 'data' dataset, of shape (num_slices, height, width), with one gzip compressed
+        chunk per b-scan so that any b-scan can be read on its own. The mask of the missing b-scans, left as zeros,
+        and the metadata are stored as attributes of the file. Requires h5py.
+
+    Args:
+        filepath (str): Location to save volume to.
+        slices (iterable of (int, np.array)): Position in the volume and data of each b-scan.
+        num_slices (int): Number of b-scans in the volume.
+        metadata (dict): Attributes of the file, e.g. type, laterality and patient_id. None values are skipped.
+        compression (int): gzip compression level, from 0 to 9.
+
+    Returns:
+        list of str: The path of the file written.
+    """
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError('Saving to HDF5 requires h5py')
+    missing = np.ones(num_slices, dtype=bool)
+    with h5py.File(filepath, 'w') as f:
+        dataset = None
+        for index, slice in slices:
+            if dataset is None:
+                dataset = f.create_dataset('data', shape=(num_slices,) + slice.shape, dtype=slice.dtype,
+                                           chunks=(1,) + slice.shape, compression='gzip',
+                                           compression_opts=compression, shuffle=True)
+            dataset[index] = slice
+            missing[index] = False
+        f.attrs['missing'] = missing
+        for key, value in (metadata or {}).items():
+            if value is not None:
+                f.attrs[key] = value
+    return [filepath]
+
+
+def write_images(images, workers=1, png_compression=None, max_pending=None):
+    """Writes images with cv2.imwrite, on a pool of threads when workers > 1.
+
+    Notes:
+        cv2 releases the GIL while encoding, so the images are encoded concurrently. Images are taken from the
+        iterable as threads become free, so that at most max_pending of them wait in memory, and the first error
+        met by a thread is raised once the images already submitted are written.
+
+    Args:
+        images (iterable of (str, np.array)): Filename and data of each image.
+        workers (int): Number of threads encoding and writing the images. Written in this thread if 1.
+        png_compression (int): Compression level of .png images, from 0 (fastest) to 9 (smallest). cv2's default
+            if None.
+        max_pending (int): Number of images submitted and not yet written, 2 * workers if None.
+
+    Returns:
+        list of str: Filenames of the images written, in order.
+    """
+    import cv2
+    params = [] if png_compression is None else [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    written = []
+    if workers <= 1:
+        for filename, image in images:
+            write_image(filename, image, params)
+            written.append(filename)
+        return written
+    max_pending = 2 * workers if max_pending is None else max_pending
+    pending = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for filename, image in images:
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(write_image, filename, image, params))
+            written.append(filename)
+        for future in pending:
+            future.result()
+    return written
 
 
+def write_image(filename, image, params=()):
+    """Writes a single image, raising an IOError if cv2 cannot. PNG parameters are ignored for other formats."""
+    if not filename.lower().endswith('.png'):
+        params = ()
+    import cv2
+    if not cv2.imwrite(filename, image, list(params)):
+        raise IOError('Could not write {}'.format(filename))
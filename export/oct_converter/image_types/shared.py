@@ -0,0 +1,134 @@
+import ctypes
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class SharedBuffer(object):
+    """ Keeps a shared memory block mapped for as long as an array backed by it is alive.
+
+    Notes:
+        numpy does not keep the buffer of a shared memory block exported once an array is built on it, so that
+        SharedMemory.close, also called when the block is garbage collected, would unmap the block under the array.
+        A SharedBuffer is the base of the array, and of every view of it, and holds a ctypes pointer into the block
+        which keeps its buffer exported: SharedMemory.close refuses to unmap the block while any array uses it, and
+        the block is closed once the last of them is collected.
+
+    Attributes:
+        shm (obj:SharedMemory): The block.
+    """
+
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self._pointer = ctypes.c_char.from_buffer(shm.buf)
+        self.__array_interface__ = {'version': 3, 'shape': tuple(shape), 'typestr': np.dtype(dtype).str,
+                                    'data': (ctypes.addressof(self._pointer), False)}
+
+    def __del__(self):
+        self._pointer = None
+        self.shm.close()
+
+
+def shared_array(shm, shape, dtype):
+    """ Array backed by a shared memory block, which stays mapped as long as the array or a view of it is alive. """
+    return np.asarray(SharedBuffer(shm, shape, dtype))
+
+
+def allocate_shared(shape, dtype):
+    """ Allocates a zeroed array in a new shared memory block.
+
+    Returns:
+        (obj:SharedMemory, np.array): The block, owned by the caller, and the array backed by it.
+    """
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+    array = shared_array(shm, shape, dtype)
+    array[...] = 0
+    return shm, array
+
+
+class SharedMemoryMixin(object):
+    """ Lets an image type hold its pixels in a multiprocessing.shared_memory block.
+
+    Notes:
+        A shared image is pickled as a handle, the name, shape and type of its block along with its metadata, so that
+        sending it to another process does not copy its pixels. The unpickled image is attached to the same block,
+        and writes to the pixels are seen by every process.
+        The process that created the block owns it, and the block lives until the owner calls unlink. Every process
+        should call close once done with the image, which drops its pixels: the block stays mapped in the process
+        until the pixels, and any view of them, are collected, see SharedBuffer. Leaving a with block does both.
+        Subclasses name the attribute holding their pixels in shared_field.
+    """
+    shared_field = None
+    _shm = None
+    _owner = False
+
+    @property
+    def shared(self):
+        """ Whether the pixels are held in shared memory. """
+        return self._shm is not None
+
+    def to_shared(self):
+        """ Moves the pixels into a new shared memory block, owned by this process.
+
+        Returns:
+            self
+        """
+        if self._shm is None:
+            array = getattr(self, self.shared_field)
+            self._shm, shared = allocate_shared(array.shape, array.dtype)
+            shared[...] = array
+            setattr(self, self.shared_field, shared)
+            self._owner = True
+        return self
+
+    def close(self):
+        """ Detaches this process from the shared memory block. """
+        if self._shm is not None:
+            setattr(self, self.shared_field, None)
+            try:
+                self._shm.close()
+            except BufferError:
+                # another array of the block is still alive, and unmaps it once collected
+                pass
+
+    def unlink(self):
+        """ Frees the shared memory block, once every process closed it. Only done by the owner. """
+        if self._shm is not None and self._owner:
+            self._shm.unlink()
+            self._owner = False
+
+    def make_private(self):
+        """ Unlinks the shared memory block, owned by this process, while keeping the pixels in it. Other processes
+        cannot attach to it anymore, the image is then pickled by value, and the block is freed along with the pixels
+        and their views.
+
+        Returns:
+            self
+        """
+        if self._shm is not None and self._owner:
+            self._shm.unlink()
+            self._shm = None
+            self._owner = False
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        self.unlink()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self._shm is not None:
+            array = state.pop(self.shared_field)
+            state['_shm'] = (self._shm.name, array.shape, array.dtype.str)
+            state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state.get('_shm'), tuple):
+            name, shape, dtype = state['_shm']
+            state['_shm'] = shared_memory.SharedMemory(name=name)
+            state[self.shared_field] = shared_array(state['_shm'], shape, dtype)
+        self.__dict__.update(state)
@@ -1,4 +1,5 @@
 from .fds import FDS
 from .img import IMG
 from .e2e import E2E
+from .index_cache import IndexCache
 from .dcm import Dicom
\ No newline at end of file
@@ -1,17 +1,229 @@
 import os
+import importlib.util
+import numpy as np
+from ..image_types import OCTVolumeWithMetaData, FundusImageWithMetaData
+
+# pydicom is imported when reading, as it is slow to import and the other readers do not need it
+
+# type of image held by each ophthalmic modality
+MODALITIES = {'OPT': 'oct', 'OP': 'fundus'}
+# implicit and explicit VR little endian, whose pixel data can be mapped as is
+UNCOMPRESSED_SYNTAXES = ['1.2.840.10008.1.2', '1.2.840.10008.1.2.1']
+PIXEL_DATA = 0x7FE00010
 
 
 class Dicom(object):
-    def __init__(self, filepath):
+    """ Class for extracting data from DICOM ophthalmic tomography (OPT) and photography (OP) exports.
+
+        Notes:
+            Files are grouped by series, each series being an OCT volume or a fundus image. A series can be a single
+            multi-frame file or one file per frame, ordered by instance number.
+            Frames are only read when accessed. Uncompressed pixel data is memory mapped, compressed pixel data is
+            decoded one file at a time.
+            Requires pydicom.
+
+        Attributes:
+            filepath (str): Folder containing .dcm files, searched recursively, or a single .dcm file.
+            use_mmap (bool): Memory map uncompressed pixel data instead of reading it.
+            series (dict): Descriptor of every series, by SeriesInstanceUID, built on first access.
+    """
+
+    def __init__(self, filepath, use_mmap=True):
+        if importlib.util.find_spec('pydicom') is None:
+            raise ImportError('Reading DICOM files requires pydicom')
+        self.filepath = filepath
+        self.use_mmap = use_mmap
+        self._series = None
+        self._decoded = (None, None)
+
+    @property
+    def series(self):
+        if self._series is None:
+            self._series = self.index_series()
+        return self._series
+
+    def list_files(self):
+        if os.path.isfile(self.filepath):
+            return [self.filepath]
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.filepath):
+            for filename in sorted(filenames):
+                if '.dcm' in filename.lower():
+                    files.append(os.path.join(dirpath, filename))
+        return files
+
+    def index_series(self):
+        """ Reads the headers of all the files, without their pixel data, and groups them by series.
+
+            Returns:
+                dict: Descriptor of every OCT and fundus series by SeriesInstanceUID, with its key, type ('oct' or
+                'fundus'), patient_id, study_id, series_id, laterality, num_slices, width and height, the patient's
+                name, surname and date of birth, and the (filepath, frame) of each of its slices.
         """
-        :param filepath: Should either be a folder containing multiples sub-volume or a single DCOM
+        import pydicom
+        series = {}
+        for filepath in self.list_files():
+            ds = pydicom.dcmread(filepath, stop_before_pixels=True, force=True)
+            kind = MODALITIES.get(ds.get('Modality'))
+            if kind is None or 'SeriesInstanceUID' not in ds:
+                continue
+            key = str(ds.SeriesInstanceUID)
+            if key not in series:
+                patient_name = ds.get('PatientName')
+                series[key] = {'key': key,
+                               'type': kind,
+                               'patient_id': str(ds.get('PatientID', '')),
+                               'study_id': str(ds.get('StudyInstanceUID', '')),
+                               'series_id': int(ds.get('SeriesNumber') or 0),
+                               'laterality': ds.get('ImageLaterality') or ds.get('Laterality'),
+                               'num_slices': 0,
+                               'width': int(ds.Columns),
+                               'height': int(ds.Rows),
+                               'patient_name': patient_name.given_name if patient_name else '',
+                               'patient_surname': patient_name.family_name if patient_name else '',
+                               'patient_dob': ds.get('PatientBirthDate'),
+                               'files': []}
+            num_frames = int(ds.get('NumberOfFrames') or 1)
+            series[key]['files'].append((int(ds.get('InstanceNumber') or 0), filepath, num_frames))
+        for descriptor in series.values():
+            files = sorted(descriptor.pop('files'))
+            descriptor['frames'] = [(filepath, frame) for _, filepath, num_frames in files
+                                    for frame in range(num_frames)]
+            descriptor['num_slices'] = len(descriptor['frames'])
+        return series
+
+    def list_volumes(self, types=None, laterality=None, series=None):
+        """ Lists the OCT volumes and fundus images of the export, without reading any pixel data.
+
+            Args:
+                types (list of str): Only list these types of images, 'oct' and/or 'fundus'.
+                laterality (str): Only list images of this eye, 'R' or 'L'.
+                series (list of int): Only list images of these series numbers.
+
+            Returns:
+                list of dict: One descriptor per image with its key, type ('oct' or 'fundus'), patient_id, study_id,
+                series_id, laterality, num_slices, width and height.
         """
-        self.filepath = filepath
+        fields = ['key', 'type', 'patient_id', 'study_id', 'series_id', 'laterality', 'num_slices', 'width', 'height']
+        descriptors = []
+        for descriptor in self.series.values():
+            if types is not None and descriptor['type'] not in types:
+                continue
+            if laterality is not None and descriptor['laterality'] != laterality:
+                continue
+            if series is not None and descriptor['series_id'] not in series:
+                continue
+            descriptors.append({field: descriptor[field] for field in fields})
+        return descriptors
+
+    def scan_metadata(self):
+        """ Lists the images of the export, as list_volumes does, with the name and surname of their patient. """
+        descriptors = self.list_volumes()
+        for descriptor in descriptors:
+            series = self.series[descriptor['key']]
+            descriptor.update(patient_name=series['patient_name'], patient_surname=series['patient_surname'])
+        return descriptors
 
     def read_oct_volume(self):
-        lstFilesDCM = []  # create an empty list
-        for dirName, subdirList, fileList in os.walk(PathDicom):
-            for filename in fileList:
-                if ".dcm" in filename.lower():  # check whether the file's DICOM
-                    lstFilesDCM.append(os.path.join(dirName, filename))
+        """ Reads all the OCT volumes.
+
+            Returns:
+                list of obj:OCTVolumeWithMetaData
+        """
+        return [self.read_volume(descriptor['key']) for descriptor in self.list_volumes(types=['oct'])]
+
+    def read_fundus_image(self):
+        """ Reads all the fundus images.
+
+            Returns:
+                list of obj:FundusImageWithMetaData
+        """
+        return [self.read_volume(descriptor['key']) for descriptor in self.list_volumes(types=['fundus'])]
+
+    def read_volume(self, key):
+        """ Reads a single series.
+
+            Notes:
+                A memory mapped multi-frame OCT file is returned as a view, whose frames are only read when accessed.
+                Colour fundus images are converted to BGR, as expected by cv2.imwrite.
+
+            Args:
+                key (str): SeriesInstanceUID of the series.
+
+            Returns:
+                obj:OCTVolumeWithMetaData or obj:FundusImageWithMetaData
+        """
+        descriptor = self.series[key]
+        metadata = {'laterality': descriptor['laterality'],
+                    'patient_id': descriptor['patient_id'],
+                    'patient_dob': descriptor['patient_dob'],
+                    'patient_name': descriptor['patient_name'],
+                    'patient_surname': descriptor['patient_surname']}
+        if descriptor['type'] == 'fundus':
+            image = self.read_frame(key, 0)
+            if image.ndim == 3:
+                image = image[..., ::-1]
+            return FundusImageWithMetaData(image, **metadata)
+
+        filepaths = set(filepath for filepath, frame in descriptor['frames'])
+        if len(filepaths) == 1:
+            return OCTVolumeWithMetaData(self._read_frames(filepaths.pop()), **metadata)
+        first = self.read_frame(key, 0)
+        volume = OCTVolumeWithMetaData.empty(descriptor['num_slices'], first.shape, first.dtype, **metadata)
+        for index, frame in enumerate(self.iter_frames(key)):
+            volume.set_slice(index, frame)
+        return volume
+
+    def read_frame(self, key, index):
+        """ Reads a single frame (b-scan) of a series.
+
+            Args:
+                key (str): SeriesInstanceUID of the series.
+                index (int): Position of the frame in the series.
+
+            Returns:
+                np.array
+        """
+        filepath, frame = self.series[key]['frames'][index]
+        return self._read_frames(filepath)[frame]
+
+    def iter_frames(self, key):
+        """ Reads the frames of a series one at a time.
+
+            Args:
+                key (str): SeriesInstanceUID of the series.
+
+            Yields:
+                np.array
+        """
+        for index in range(self.series[key]['num_slices']):
+            yield self.read_frame(key, index)
+
+    def _read_frames(self, filepath):
+        """ All the frames of a file, as a (num_frames, rows, cols[, samples]) array. """
+        if self._decoded[0] == filepath:
+            return self._decoded[1]
+        import pydicom
+        ds = pydicom.dcmread(filepath, defer_size=1024, force=True)
+        num_frames = int(ds.get('NumberOfFrames') or 1)
+        samples = int(ds.get('SamplesPerPixel', 1))
+        shape = (num_frames, int(ds.Rows), int(ds.Columns)) + ((samples,) if samples > 1 else ())
+        if self.use_mmap and ds.file_meta.TransferSyntaxUID in UNCOMPRESSED_SYNTAXES \
+                and int(ds.get('PlanarConfiguration', 0)) == 0 and ds.BitsAllocated in [8, 16]:
+            dtype = np.dtype('<{}{}'.format('i' if ds.get('PixelRepresentation', 0) else 'u', ds.BitsAllocated // 8))
+            offset = pixel_data_offset(ds)
+            frames = np.memmap(filepath, dtype=dtype, mode='r', offset=offset, shape=shape)
+        else:
+            frames = ds.pixel_array.reshape(shape)
+        self._decoded = (filepath, frames)
+        return frames
+
 
+def pixel_data_offset(ds):
+    """ Position in the file of the value of the PixelData element of a dataset read with defer_size. """
+    try:
+        element = ds.get_item(PIXEL_DATA, keep_deferred=True)
+    except TypeError:
+        # before pydicom 3, deferred elements are always returned raw
+        element = ds.get_item(PIXEL_DATA)
+    return element.value_tell
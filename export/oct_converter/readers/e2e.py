@@ -1,8 +1,49 @@
+import contextlib
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
-from construct import PaddedString, Int16un, Struct, Int32sn, Int32un, Array, Int8un
 from ..image_types import OCTVolumeWithMetaData, FundusImageWithMetaData
+from . import structures
 import datetime
 
+PATIENT_CHUNK = 9
+LATERALITY_CHUNK = 11
+IMAGE_CHUNK = 1073741824
+# pixel data of image chunks follows the chunk and image headers
+IMAGE_DATA_OFFSET = structures.E2E_CHUNK.itemsize + structures.E2E_IMAGE.itemsize
+
+INDEX_DTYPE = np.dtype([
+    ('patient_id', '<u4'),
+    ('study_id', '<u4'),
+    ('series_id', '<u4'),
+    ('slice_id', '<i4'),
+    ('type', '<u4'),
+    ('ind', '<u2'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('start', '<u4'),
+    ('size', '<u4'),
+])
+
+
+def volume_key(chunk):
+    """ Key identifying the volume a chunk belongs to. """
+    return '{}_{}_{}'.format(chunk.patient_id, chunk.study_id, chunk.series_id)
+
+
+def slice_index(slice_id, num_slices):
+    """ Position in its volume of the b-scan with the given slice id, None if out of the volume.
+
+    Notes:
+        Slice ids of 0 and 1 give the last position, and negative ones count from the end of the volume, as they
+        did when the b-scans were stored in a list.
+    """
+    position = int(slice_id / 2) - 1
+    if not -num_slices <= position < num_slices:
+        return None
+    return position % num_slices
+
 
 class E2E(object):
     """ Class for extracting data from Heidelberg's .e2e file format.
@@ -13,203 +54,472 @@ class E2E(object):
 
         Attributes:
             filepath (str): Path to .img file for reading.
-            header_structure (obj:Struct): Defines structure of volume's header.
-            main_directory_structure (obj:Struct): Defines structure of volume's main directory.
-            sub_directory_structure (obj:Struct): Defines structure of each sub directory in the volume.
-            chunk_structure (obj:Struct): Defines structure of each data chunk.
-            image_structure (obj:Struct): Defines structure of image header.
+            use_mmap (bool): Read the file through a memory map, fundus images and raw b-scans then being views into it.
+            index_cache (obj:IndexCache): Optional on-disk cache the chunk index is read from and saved to.
+            workers (int): Number of processes decoding the b-scans of a volume in read_volume and read_oct_volume.
+            header_structure (np.dtype): Defines structure of volume's header.
+            main_directory_structure (np.dtype): Defines structure of volume's main directory.
+            sub_directory_structure (np.dtype): Defines structure of each sub directory in the volume.
+            chunk_structure (np.dtype): Defines structure of each data chunk.
+            image_structure (np.dtype): Defines structure of image header.
+            index (np.recarray): Location of every data chunk in the file, built on first access.
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, use_mmap=False, index_cache=None, workers=1):
         self.filepath = filepath
-        self.header_structure = Struct(
-            'magic' / PaddedString(12, 'ascii'),
-            'version' / Int32un,
-            'unknown' / Array(10, Int16un)
-        )
-        self.main_directory_structure = Struct(
-            'magic' / PaddedString(12, 'ascii'),
-            'version' / Int32un,
-            'unknown' / Array(10, Int16un),
-            'num_entries' / Int32un,
-            'current' / Int32un,
-            'prev' / Int32un,
-            'unknown3' / Int32un,
-        )
-        self.sub_directory_structure = Struct(
-            'pos' / Int32un,
-            'start' / Int32un,
-            'size' / Int32un,
-            'unknown' / Int32un,
-            'patient_id' / Int32un,
-            'study_id' / Int32un,
-            'series_id' / Int32un,
-            'slice_id' / Int32sn,
-            'unknown2' / Int16un,
-            'unknown3' / Int16un,
-            'type' / Int32un,
-            'unknown4' / Int32un,
-        )
-        self.chunk_structure = Struct(
-            'magic' / PaddedString(12, 'ascii'),
-            'unknown' / Int32un,
-            'unknown2' / Int32un,
-            'pos' / Int32un,
-            'size' / Int32un,
-            'unknown3' / Int32un,
-            'patient_id' / Int32un,
-            'study_id' / Int32un,
-            'series_id' / Int32un,
-            'slice_id' / Int32sn,
-            'ind' / Int16un,
-            'unknown4' / Int16un,
-            'type' / Int32un,
-            'unknown5' / Int32un,
-        )
-        self.image_structure = Struct(
-            'size' / Int32un,
-            'type' / Int32un,
-            'unknown' / Int32un,
-            'width' / Int32un,
-            'height' / Int32un,
-        )
-        self.patient_structure = Struct(
-            'name' / PaddedString(31, 'ascii'),
-            'surname' / PaddedString(66, 'ascii'),
-            'birthdate' / Int32un,
-            'sex' / PaddedString(1, 'ascii')
-        )
-        self.laterality_structure = Struct(
-            'unknown' / Array(14, Int8un),
-            'laterality' / PaddedString(1, 'ascii')
-        )
-
-    def read_oct_volume(self):
-        """ Reads OCT data.
+        self.use_mmap = use_mmap
+        self.index_cache = index_cache
+        self.workers = workers
+        self.header_structure = structures.E2E_HEADER
+        self.main_directory_structure = structures.E2E_MAIN_DIRECTORY
+        self.sub_directory_structure = structures.E2E_SUB_DIRECTORY
+        self.chunk_structure = structures.E2E_CHUNK
+        self.image_structure = structures.E2E_IMAGE
+        self.patient_structure = structures.E2E_PATIENT
+        self.laterality_structure = structures.E2E_LATERALITY
+        self._index = None
+        self._volumes = None
+        self._mmap = None
+
+    @property
+    def index(self):
+        """ Chunk index of the file, built on first access (see build_index) unless found in the index cache. """
+        if self._index is None and self.index_cache is not None:
+            self._index = self.index_cache.get(self.filepath)
+        if self._index is None:
+            self._index = self.build_index()
+            if self.index_cache is not None:
+                self.index_cache.put(self.filepath, self._index)
+        return self._index
+
+    def build_index(self):
+        """ Walks the directories of the file and records where each data chunk is stored.
+
+            Notes:
+                Only the chunk and image headers of image chunks are read, to get their ind and dimensions.
 
             Returns:
-                obj:OCTVolumeWithMetaData
+                np.recarray: One INDEX_DTYPE record per data chunk, in directory order.
         """
-        with open(self.filepath, 'rb') as f:
-            raw = f.read(36)
-            header = self.header_structure.parse(raw)
+        with self._open() as read:
+            raw = read(0, self.header_structure.itemsize)
+            header = structures.parse(self.header_structure, raw)
 
-            raw = f.read(52)
-            main_directory = self.main_directory_structure.parse(raw)
+            raw = read(self.header_structure.itemsize, self.main_directory_structure.itemsize)
+            main_directory = structures.parse(self.main_directory_structure, raw)
 
             # traverse list of main directories in first pass
             directory_stack = []
 
-            current = main_directory.current
+            current = int(main_directory.current)
             while current != 0:
                 directory_stack.append(current)
-                f.seek(current)
-                raw = f.read(52)
-                directory_chunk = self.main_directory_structure.parse(raw)
-                current = directory_chunk.prev
-
-            # traverse in second pass and  get all subdirectories
-            chunk_stack = []
-            volume_dict = {}
+                raw = read(current, self.main_directory_structure.itemsize)
+                directory_chunk = structures.parse(self.main_directory_structure, raw)
+                current = int(directory_chunk.prev)
+
+            # traverse in second pass and parse each block of subdirectories at once
+            entries = []
             for position in directory_stack:
-                f.seek(position)
-                raw = f.read(52)
-                directory_chunk = self.main_directory_structure.parse(raw)
-
-                for ii in range(directory_chunk.num_entries):
-                    raw = f.read(44)
-                    chunk = self.sub_directory_structure.parse(raw)
-                    volume_string = '{}_{}_{}'.format(chunk.patient_id, chunk.study_id, chunk.series_id)
-                    if volume_string not in volume_dict.keys():
-                        volume_dict[volume_string] = chunk.slice_id / 2
-                    elif chunk.slice_id / 2 > volume_dict[volume_string]:
-                        volume_dict[volume_string] = chunk.slice_id / 2
-
-                    if chunk.start > chunk.pos:
-                        chunk_stack.append([chunk.start, chunk.size])
-
-            # initalise dict to hold all the image volumes
-            volume_array_dict = {}
-            laterality_array_dict = {}
-            image_array_dict = {}
-            patient_array_data = {}
-            for volume, num_slices in volume_dict.items():
-                if num_slices > 0:
-                    volume_array_dict[volume] = [0] * int(num_slices)
-
-            # traverse all chunks and extract slices
-            for start, pos in chunk_stack:
-                f.seek(start)
-                raw = f.read(60)
-                chunk = self.chunk_structure.parse(raw)
-                volume_string = '{}_{}_{}'.format(chunk.patient_id, chunk.study_id, chunk.series_id)
-                patient_array_data[volume_string] = {'name':'', 'surname':'','birthdate':''}
-                if chunk.type == 9:
-                    """
-                    Patient data
-                
-                    Birthdate conversion is not working
-                    """
-                    raw = f.read(102)
-                    patient_data = self.patient_structure.parse(raw)
-                    julian_date = str((patient_data.birthdate//64)-14558805)
-                    # centuryArray = ['19', '20', '21']
-                    # d = centuryArray[int(julian_date[:1])] + julian_date[1:]
-                    d = julian_date
-                    patient_array_data[volume_string] = {'name':patient_data.name,
-                                                         'surname':patient_data.surname,
-                                                         'birthdate': d}
-                if chunk.type == 11:
-                    '''
-                    Laterality
-                    '''
-                    if volume_string not in laterality_array_dict:
-                        raw = f.read(15)
-                        laterality = self.laterality_structure.parse(raw)
-                        laterality_array_dict[volume_string] = laterality.laterality
-
-                if chunk.type == 1073741824:  # image data
-                    '''
-                    2D data
-                    '''
-                    raw = f.read(20)
-                    image_data = self.image_structure.parse(raw)
-
-                    if chunk.ind == 0:  # fundus data
-                        if volume_string not in image_array_dict:
-                            all_bits = f.read(image_data.height * image_data.width)
-                            img = np.frombuffer(all_bits, dtype=np.uint8)
-                            img = img.reshape(image_data.height, image_data.width)
-                            image_array_dict[volume_string] = img
-
-                    elif chunk.ind == 1:  # oct
-                        '''
-                        B-scan data
-                        '''
-                        all_bits = [np.frombuffer(f.read(2), dtype=np.uint8) for i in range(image_data.height * image_data.width)]
-                        raw_volume = numpy_read_custom_float(np.asarray(all_bits))
-                        image = np.array(raw_volume).reshape(image_data.width, image_data.height)
-                        image = 256 * pow(image, 1.0 / 2.4)
-
-                        if volume_string in volume_array_dict.keys():
-                            volume_array_dict[volume_string][int(chunk.slice_id / 2) - 1] = image
-                        else:
-                            print('Failed to save image data for volume {}'.format(volume_string))
-
-            oct_data = []
-            for key, volume in volume_array_dict.items():
-                oct_data.append(OCTVolumeWithMetaData(volume=volume,
-                                                      patient_id=key,
-                                                      laterality=laterality_array_dict[key],
-                                                      patient_name=patient_array_data[key]['name'],
-                                                      patient_surname=patient_array_data[key]['surname']))
-
-            for key, img in image_array_dict.items():
-                oct_data.append(FundusImageWithMetaData(image=img, patient_id=key,
-                                                        laterality=laterality_array_dict[key]))
+                raw = read(position, self.main_directory_structure.itemsize)
+                directory_chunk = structures.parse(self.main_directory_structure, raw)
+                num_entries = int(directory_chunk.num_entries)
+
+                raw = read(position + self.main_directory_structure.itemsize,
+                           num_entries * self.sub_directory_structure.itemsize)
+                chunks = structures.parse_array(self.sub_directory_structure, raw, num_entries)
+                entries.append(chunks[chunks.start > chunks.pos])
+
+            entries = np.concatenate(entries) if entries else np.recarray(0, dtype=self.sub_directory_structure)
+            index = np.zeros(len(entries), dtype=INDEX_DTYPE).view(np.recarray)
+            for field in ('patient_id', 'study_id', 'series_id', 'slice_id', 'type', 'start', 'size'):
+                index[field] = entries[field]
+
+            # image chunks also need their ind (fundus or b-scan) and dimensions
+            for row in np.flatnonzero(index.type == IMAGE_CHUNK):
+                raw = read(int(index.start[row]), IMAGE_DATA_OFFSET)
+                chunk = structures.parse(self.chunk_structure, raw)
+                image_data = structures.parse(self.image_structure, raw[self.chunk_structure.itemsize:])
+                index.ind[row] = chunk.ind
+                index.width[row] = image_data.width
+                index.height[row] = image_data.height
+        return index
+
+    def _group_chunks(self):
+        """ Groups the chunks of the index by volume.
+
+            Returns:
+                dict: For each volume key, the index rows of its fundus, b-scans (by slice position), patient data
+                and laterality chunks.
+        """
+        if self._volumes is None:
+            volumes = {}
+            for row, record in enumerate(self.index):
+                key = volume_key(record)
+                if key not in volumes:
+                    volumes[key] = {'max_slice_id': record.slice_id, 'fundus': None, 'bscans': [],
+                                    'patient': None, 'laterality': None}
+                volume = volumes[key]
+                volume['max_slice_id'] = max(volume['max_slice_id'], record.slice_id)
+                if record.type == PATIENT_CHUNK:
+                    volume['patient'] = row
+                elif record.type == LATERALITY_CHUNK and volume['laterality'] is None:
+                    volume['laterality'] = row
+                elif record.type == IMAGE_CHUNK:
+                    if record.ind == 0 and volume['fundus'] is None:
+                        volume['fundus'] = row
+                    elif record.ind == 1:
+                        volume['bscans'].append(row)
+            for key, volume in volumes.items():
+                volume['num_slices'] = max(int(volume['max_slice_id'] / 2), 0)
+                # the last b-scan in directory order wins when several land at the same position
+                volume['slices'] = {}
+                for row in volume.pop('bscans'):
+                    position = slice_index(self.index.slice_id[row], volume['num_slices'])
+                    if position is None:
+                        print('Failed to save image data for volume {}'.format(key))
+                    else:
+                        volume['slices'][position] = row
+            self._volumes = volumes
+        return self._volumes
+
+    def _get_volume(self, key):
+        volumes = self._group_chunks()
+        if key not in volumes:
+            raise ValueError('Could not find volume {} in {}'.format(key, self.filepath))
+        return volumes[key]
+
+    def list_volumes(self, types=None, laterality=None, series=None):
+        """ Lists the OCT volumes and fundus images contained in the file, without reading any pixel data.
+
+            Args:
+                types (list of str): Only list these types of images, 'oct' and/or 'fundus'.
+                laterality (str): Only list images of this eye, 'R' or 'L'.
+                series (list of int): Only list images of these series.
+
+            Returns:
+                list of dict: One descriptor per image with its key, type ('oct' or 'fundus'), patient_id, study_id,
+                series_id, laterality, num_slices, width and height.
+        """
+        descriptors = []
+        with self._open() as read:
+            for key, volume in self._group_chunks().items():
+                kinds = []
+                if volume['num_slices'] > 0 and volume['slices']:
+                    kinds.append(('oct', next(iter(volume['slices'].values())), volume['num_slices']))
+                if volume['fundus'] is not None:
+                    kinds.append(('fundus', volume['fundus'], 1))
+                for kind, row, num_slices in kinds:
+                    record = self.index[row]
+                    if types is not None and kind not in types:
+                        continue
+                    if series is not None and record.series_id not in series:
+                        continue
+                    volume_laterality = self._read_laterality(read, volume)
+                    if laterality is not None and volume_laterality != laterality:
+                        continue
+                    descriptors.append({'key': key,
+                                        'type': kind,
+                                        'patient_id': int(record.patient_id),
+                                        'study_id': int(record.study_id),
+                                        'series_id': int(record.series_id),
+                                        'laterality': volume_laterality,
+                                        'num_slices': num_slices,
+                                        'width': int(record.width),
+                                        'height': int(record.height)})
+        return descriptors
+
+    def scan_metadata(self):
+        """ Reads the metadata of the images contained in the file, without reading any pixel data.
+
+            Returns:
+                list of dict: The descriptors of list_volumes, with the patient_name and patient_surname added.
+        """
+        rows = []
+        with self._open() as read:
+            for descriptor in self.list_volumes():
+                patient = self._read_patient(read, self._get_volume(descriptor['key']))
+                row = dict(descriptor, patient_name=patient['name'], patient_surname=patient['surname'])
+                rows.append(row)
+        return rows
+
+    def read_oct_volume(self, dtype=np.float64, types=None, laterality=None, series=None, slices=None):
+        """ Reads the OCT volumes and fundus images of the file.
+
+            Notes:
+                Images filtered out are skipped from the chunk index, without reading any of their pixel data.
+
+            Args:
+                dtype (np.dtype): Type of the decoded b-scans, one of BSCAN_TYPES.
+                types (list of str): Only read these types of images, 'oct' and/or 'fundus'.
+                laterality (str): Only read images of this eye, 'R' or 'L'.
+                series (list of int): Only read images of these series.
+                slices (slice): Only read the b-scans of OCT volumes at these positions, others being left empty.
 
+            Returns:
+                list of obj:OCTVolumeWithMetaData and obj:FundusImageWithMetaData
+        """
+        descriptors = self.list_volumes(types=types, laterality=laterality, series=series)
+        oct_data = []
+        with self._open() as read, self._executor() as executor:
+            for descriptor in descriptors:
+                if descriptor['type'] == 'oct':
+                    oct_data.append(self._read_volume(read, descriptor['key'], dtype, executor, slices))
+            for descriptor in descriptors:
+                if descriptor['type'] == 'fundus':
+                    oct_data.append(self._read_fundus(read, descriptor['key']))
         return oct_data
 
+    def iter_volumes(self, dtype=np.float64, types=None, laterality=None, series=None, slices=None):
+        """ Decodes the file volume by volume and slice by slice, so that only one b-scan is held in memory.
+
+            Notes:
+                Each slices generator must be consumed before moving on to the next volume.
+
+            Args:
+                dtype (np.dtype): Type of the decoded b-scans, one of BSCAN_TYPES.
+                types, laterality, series, slices: Filters, see read_oct_volume.
+
+            Yields:
+                (dict, generator): The descriptor of each volume, as given by list_volumes, and a generator of
+                (position, np.array) for its b-scans in order, or for its single fundus image.
+        """
+        with self._open() as read:
+            for descriptor in self.list_volumes(types=types, laterality=laterality, series=series):
+                yield descriptor, self._iter_slices(read, descriptor, dtype, slices)
+
+    def read_volume(self, key, dtype=np.float64, slices=None, shared=False):
+        """ Reads a single OCT volume.
+
+            Args:
+                key (str): Key of the volume, as given by list_volumes.
+                dtype (np.dtype): Type of the decoded b-scans, one of BSCAN_TYPES.
+                slices (slice): Only read the b-scans at these positions, others being left empty.
+                shared (bool): Decode the b-scans into a shared memory block owned by this process, so that the
+                    volume can be sent to other processes without copying it, see SharedMemoryMixin.
+
+            Returns:
+                obj:OCTVolumeWithMetaData
+        """
+        with self._open() as read, self._executor() as executor:
+            return self._read_volume(read, key, dtype, executor, slices, shared)
+
+    def read_slice(self, key, index, dtype=np.float64):
+        """ Reads a single b-scan of an OCT volume.
+
+            Args:
+                key (str): Key of the volume, as given by list_volumes.
+                index (int): Position of the b-scan in the volume.
+                dtype (np.dtype): Type of the decoded b-scan, one of BSCAN_TYPES.
+
+            Returns:
+                np.array
+        """
+        volume = self._get_volume(key)
+        if index not in volume['slices']:
+            raise ValueError('Could not find slice {} of volume {}'.format(index, key))
+        with self._open() as read:
+            return self._read_bscan(read, volume['slices'][index], dtype)
+
+    def read_raw_slice(self, key, index):
+        """ Reads the undecoded 16-bit words of a single b-scan of an OCT volume.
+
+            Notes:
+                In mmap mode, the returned array is a read-only view into the file.
+
+            Args:
+                key (str): Key of the volume, as given by list_volumes.
+                index (int): Position of the b-scan in the volume.
+
+            Returns:
+                np.array
+        """
+        volume = self._get_volume(key)
+        if index not in volume['slices']:
+            raise ValueError('Could not find slice {} of volume {}'.format(index, key))
+        with self._open() as read:
+            return self._read_bscan_words(read, volume['slices'][index])
+
+    def iter_raw_slices(self, key, slices=None):
+        """ Reads the undecoded b-scans of an OCT volume one at a time, to be decoded elsewhere with
+            custom_float_table.
+
+            Args:
+                key (str): Key of the volume, as given by list_volumes.
+                slices (slice): Only read the b-scans at these positions.
+
+            Yields:
+                (int, np.array): Position of each b-scan in the volume and its 16-bit words, see read_raw_slice.
+        """
+        volume = self._get_volume(key)
+        rows = self._select_slices(volume, slices)
+        with self._open() as read:
+            for position in sorted(rows):
+                yield position, self._read_bscan_words(read, rows[position])
+
+    def read_fundus(self, key):
+        """ Reads the fundus image of a volume.
+
+            Args:
+                key (str): Key of the volume, as given by list_volumes.
+
+            Returns:
+                obj:FundusImageWithMetaData
+        """
+        with self._open() as read:
+            return self._read_fundus(read, key)
+
+    def open(self):
+        """ Maps the file in memory. Only needed in mmap mode, where it is otherwise done on first read. """
+        if self.use_mmap and self._mmap is None:
+            with open(self.filepath, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def close(self):
+        """ Releases the memory map of the file.
+
+            Notes:
+                Arrays still viewing the file keep the mapping alive until they are garbage collected.
+        """
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @contextlib.contextmanager
+    def _open(self):
+        """ Yields a function reading size bytes at offset, from the memory map in mmap mode. """
+        if self.use_mmap:
+            buffer = memoryview(self.open()._mmap)
+            yield lambda offset, size: buffer[offset:offset + size]
+        else:
+            with open(self.filepath, 'rb') as f:
+                def read(offset, size):
+                    f.seek(offset)
+                    return f.read(size)
+                yield read
+
+    def _select_slices(self, volume, slices):
+        """ Rows of the b-scans of a volume, by position, restricted to the positions selected by slices. """
+        if slices is None:
+            return volume['slices']
+        selected = set(range(volume['num_slices'])[slices])
+        return {position: row for position, row in volume['slices'].items() if position in selected}
+
+    def _iter_slices(self, read, descriptor, dtype, slices=None):
+        volume = self._get_volume(descriptor['key'])
+        if descriptor['type'] == 'fundus':
+            yield 0, self._read_fundus(read, descriptor['key']).image
+        else:
+            rows = self._select_slices(volume, slices)
+            for position in sorted(rows):
+                yield position, self._read_bscan(read, rows[position], dtype)
+
+    def _executor(self):
+        """ Pool of processes decoding b-scans, or a null context when decoding in this process. """
+        if self.workers > 1:
+            return ProcessPoolExecutor(max_workers=self.workers)
+        return contextlib.nullcontext()
+
+    def _read_volume(self, read, key, dtype, executor=None, slices=None, shared=False):
+        volume = self._get_volume(key)
+        rows = self._select_slices(volume, slices)
+        record = self.index[next(iter(volume['slices'].values()))]
+        patient = self._read_patient(read, volume)
+        # the worker processes decode straight into the volume, held in shared memory while they do
+        in_shared_memory = shared or executor is not None
+        oct_volume = OCTVolumeWithMetaData.empty(volume['num_slices'], (int(record.width), int(record.height)),
+                                                 dtype=dtype,
+                                                 shared=in_shared_memory,
+                                                 patient_id=key,
+                                                 laterality=self._read_laterality(read, volume),
+                                                 patient_name=patient['name'],
+                                                 patient_surname=patient['surname'])
+        if executor is None or not self._decode_volume(rows, oct_volume.volume, executor, oct_volume._shm):
+            for position, row in rows.items():
+                self._read_bscan(read, row, dtype, out=oct_volume.volume[position])
+        for position in rows:
+            oct_volume.missing[position] = False
+        if in_shared_memory and not shared:
+            # the pixels keep the unlinked block mapped for as long as they or a view of them are used
+            oct_volume.make_private()
+        return oct_volume
+
+    def _decode_volume(self, rows, out, executor, shm):
+        """ Decodes b-scans of a volume in the worker processes, straight into its shared memory block.
+
+            Args:
+                rows (dict): Index rows of the b-scans to decode, by position.
+                out (np.array): Volume the b-scans are decoded into.
+                shm (obj:SharedMemory): Block holding out.
+
+            Returns:
+                bool: False if the b-scans do not all have the volume's size, and were not decoded.
+        """
+        records = self.index[list(rows.values())]
+        if np.any(records.width != out.shape[1]) or np.any(records.height != out.shape[2]):
+            return False
+        jobs = [(int(self.index.start[row]) + IMAGE_DATA_OFFSET, position) for position, row in rows.items()]
+        futures = [executor.submit(decode_shared_bscans, self.filepath, shm.name, out.shape, out.dtype.str,
+                                   jobs[i::self.workers]) for i in range(min(self.workers, len(jobs)))]
+        for future in futures:
+            future.result()
+        return True
+
+    def _read_fundus(self, read, key):
+        volume = self._get_volume(key)
+        if volume['fundus'] is None:
+            raise ValueError('Could not find fundus image of volume {}'.format(key))
+        record = self.index[volume['fundus']]
+        all_bits = read(record.start + IMAGE_DATA_OFFSET, record.height * record.width)
+        img = np.frombuffer(all_bits, dtype=np.uint8)
+        img = img.reshape(record.height, record.width)
+        return FundusImageWithMetaData(image=img, patient_id=key,
+                                       laterality=self._read_laterality(read, volume))
+
+    def _read_bscan_words(self, read, row):
+        record = self.index[row]
+        raw = read(record.start + IMAGE_DATA_OFFSET, 2 * record.height * record.width)
+        return np.frombuffer(raw, dtype='<u2').reshape(record.width, record.height)
+
+    def _read_bscan(self, read, row, dtype, out=None):
+        return np.take(custom_float_table(dtype), self._read_bscan_words(read, row), out=out)
+
+    def _read_laterality(self, read, volume):
+        if volume['laterality'] is None:
+            return None
+        raw = read(int(self.index[volume['laterality']].start) + self.chunk_structure.itemsize,
+                   self.laterality_structure.itemsize)
+        return structures.to_str(structures.parse(self.laterality_structure, raw).laterality)
+
+    def _read_patient(self, read, volume):
+        """
+        Patient data
+
+        Birthdate conversion is not working
+        """
+        if volume['patient'] is None:
+            return {'name': '', 'surname': '', 'birthdate': ''}
+        raw = read(int(self.index[volume['patient']].start) + self.chunk_structure.itemsize,
+                   self.patient_structure.itemsize)
+        patient_data = structures.parse(self.patient_structure, raw)
+        julian_date = str((int(patient_data.birthdate) // 64) - 14558805)
+        # centuryArray = ['19', '20', '21']
+        # d = centuryArray[int(julian_date[:1])] + julian_date[1:]
+        d = julian_date
+        return {'name': structures.to_str(patient_data.name),
+                'surname': structures.to_str(patient_data.surname),
+                'birthdate': d}
+
     def read_custom_float(self, bytes):
         """ Implementation of bespoke float type used in .e2e files.
 
@@ -263,16 +573,64 @@ def read_custom_float(bytes):
     return decimal_value
 
 
-def numpy_read_custom_float(bytes_array):
-    bits_f, bits_s = np.unpackbits(bytes_array[:, 0]).astype(bool), np.unpackbits(bytes_array[:, 1]).astype(bool)
-    bits_f, bits_s = bits_f.reshape((bytes_array.shape[0], 8))[:, ::-1], bits_s.reshape((bytes_array.shape[0], 8))[:, ::-1]
+GAMMA = 1.0 / 2.4
+BSCAN_TYPES = (np.float64, np.float32, np.uint16, np.uint8)
+_lookup_tables = {}
 
-    bits = np.hstack((bits_f, bits_s))
-    mantissa = bits[:, :10]
-    exponent = bits[:, 10:][:, ::-1]
-    exponent = np.hstack((np.zeros((exponent.shape[0], 2), dtype=np.bool), exponent))
-    power = pow(2, 10)
-    mantissa = np.hstack((np.zeros((mantissa.shape[0], 6), dtype=np.bool), mantissa))
-    mantissa_sum = 1 + np.packbits(mantissa.reshape(-1, 2, 8)[:, ::-1]).view(np.uint16) / power
-    exponent_sum = (np.packbits(exponent, -1).astype(np.float) - 63).squeeze()
-    return mantissa_sum.astype(np.float) * np.power(2, exponent_sum)
+
+def custom_float_table(dtype=np.float64):
+    """ Lookup table mapping each of the 65536 possible 16-bit words of a b-scan to its gamma corrected intensity.
+
+    Notes:
+        Values are bit-exact with read_custom_float followed by 256 * pow(value, GAMMA). Integer tables are rounded
+        and saturated, as cv2.imwrite does when saving floating point slices.
+
+    Args:
+        dtype (np.dtype): Type of the table, one of BSCAN_TYPES.
+
+    Returns:
+        np.array
+    """
+    dtype = np.dtype(dtype)
+    if dtype not in _lookup_tables:
+        if dtype.type not in BSCAN_TYPES:
+            raise ValueError('Unsupported b-scan dtype {}'.format(dtype))
+        words = np.arange(pow(2, 16), dtype=np.uint32)
+        # the mantissa is stored with its 10 bits in reversed order (see read_custom_float)
+        mantissa = np.zeros_like(words)
+        for bit in range(10):
+            mantissa |= ((words >> bit) & 1) << (9 - bit)
+        exponent = (words >> 10).astype(np.float64) - 63
+        table = (1 + mantissa / pow(2, 10)) * np.power(2, exponent)
+        table = 256 * np.power(table, GAMMA)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            table = np.clip(np.rint(table), info.min, info.max)
+        table = table.astype(dtype)
+        table.flags.writeable = False
+        _lookup_tables[dtype] = table
+    return _lookup_tables[dtype]
+
+
+def decode_shared_bscans(filepath, shm_name, shape, dtype, jobs):
+    """ Decodes b-scans of a file into a volume held in shared memory. Runs in the worker processes of E2E.
+
+    Args:
+        filepath (str): Path to the .e2e file.
+        shm_name (str): Name of the shared memory block holding the volume.
+        shape (tuple): Shape of the volume, (num_slices, width, height).
+        dtype (str): Type of the volume, one of BSCAN_TYPES.
+        jobs (list of (int, int)): Offset of the pixel data of each b-scan, and its position in the volume.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        volume = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        table = custom_float_table(dtype)
+        with open(filepath, 'rb') as f:
+            for offset, position in jobs:
+                f.seek(offset)
+                words = np.frombuffer(f.read(2 * shape[1] * shape[2]), dtype='<u2').reshape(shape[1:])
+                np.take(table, words, out=volume[position])
+        del volume
+    finally:
+        shm.close()
@@ -1,6 +1,9 @@
-from construct import PaddedString,  Struct,  Int32un
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from ..image_types import OCTVolumeWithMetaData, FundusImageWithMetaData
+from . import structures
 
 
 class FDS(object):
@@ -10,40 +13,46 @@ class FDS(object):
             Mostly based on description of .fds file format here:
             https://bitbucket.org/uocte/uocte/wiki/Topcon%20File%20Format
 
+            The OCT volume is read from the raw @IMG_SCAN_03 chunk when present, otherwise from the @IMG_JPEG chunk,
+            which holds one JPEG per b-scan.
+
+            The file is opened once, on creation, and stays open until close is called (or the FDS is used as a
+            context manager).
+
         Attributes:
             filepath (str): Path to .img file for reading.
-            header (obj:Struct): Defines structure of volume's header.
-            oct_header (obj:Struct): Defines structure of OCT header.
-            fundus_header (obj:Struct): Defines structure of fundus header.
+            use_mmap (bool): Return the OCT volume as a view into a memory map of the file, whose b-scans are only
+                read from disk when accessed.
+            workers (int): Number of threads decoding the b-scans of an @IMG_JPEG volume.
+            header (np.dtype): Defines structure of volume's header.
+            oct_header (np.dtype): Defines structure of OCT header.
+            jpeg_header (np.dtype): Defines structure of the header of JPEG compressed OCT volumes.
+            fundus_header (np.dtype): Defines structure of fundus header.
             chunk_dict (dict): Name of data chunks present in the file, and their start locations.
+            timings (dict): Time spent (s) listing the chunks and reading each type of chunk.
     """
-    def __init__(self, filepath):
+    def __init__(self, filepath, use_mmap=False, workers=4):
         self.filepath = filepath
-        self.header = Struct(
-            'FOCT' / PaddedString(4, 'ascii'),
-            'FDA' / PaddedString(3, 'ascii'),
-            'version_info_1' / Int32un,
-            'version_info_2' / Int32un
-        )
-        self.oct_header = Struct(
-            'unknown' / PaddedString(1, 'ascii'),
-            'width' / Int32un,
-            'height' / Int32un,
-            'bits_per_pixel' / Int32un,
-            'number_slices' / Int32un,
-            'unknown' / PaddedString(1, 'ascii'),
-            'size' / Int32un,
-        )
-        self.fundus_header = Struct(
-            'width' / Int32un,
-            'height' / Int32un,
-            'bits_per_pixel' / Int32un,
-            'number_slices' / Int32un,
-            'unknown' / PaddedString(1, 'ascii'),
-            'size' / Int32un,
-        )
+        self.use_mmap = use_mmap
+        self.workers = workers
+        self.header = structures.FDS_HEADER
+        self.oct_header = structures.FDS_OCT_HEADER
+        self.jpeg_header = structures.FDS_JPEG_HEADER
+        self.fundus_header = structures.FDS_FUNDUS_HEADER
+        self.timings = {}
+        self.file = open(self.filepath, 'rb')
+        start = time.perf_counter()
         self.chunk_dict = self.get_list_of_file_chunks()
+        self.timings['chunk_table'] = time.perf_counter() - start
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
     def get_list_of_file_chunks(self):
         """Find all data chunks present in the file.
@@ -52,46 +61,152 @@ class FDS(object):
             dict
         """
         chunk_dict = {}
-        with open(self.filepath, 'rb') as f:
-            # skip header
-            raw = f.read(15)
-            header = self.header.parse(raw)
-
-            eof = False
-            while not eof:
-                chunk_name_size = np.fromstring(f.read(1), dtype=np.uint8)[0]
-                if chunk_name_size == 0:
-                    eof = True
-                else:
-                    chunk_name = f.read(chunk_name_size)
-                    chunk_size = np.fromstring(f.read(4), dtype=np.uint32)[0]
-                    chunk_location = f.tell()
-                    f.seek(chunk_size, 1)
-                    chunk_dict[chunk_name] = [chunk_location, chunk_size]
-        print('File {} contains the following chunks:'.format(self.filepath))
-        for key in chunk_dict.keys():
-            print(key)
+        f = self.file
+        f.seek(0)
+        # skip header
+        raw = f.read(self.header.itemsize)
+        header = structures.parse(self.header, raw)
+
+        eof = False
+        while not eof:
+            raw = f.read(1)
+            chunk_name_size = struct.unpack('<B', raw)[0] if raw else 0
+            if chunk_name_size == 0:
+                eof = True
+            else:
+                chunk_name = f.read(chunk_name_size)
+                chunk_size = struct.unpack('<I', f.read(4))[0]
+                chunk_location = f.tell()
+                f.seek(chunk_size, 1)
+                chunk_dict[chunk_name] = [chunk_location, chunk_size]
         return chunk_dict
 
+    def scan_metadata(self):
+        """ Reads the headers of the OCT volume and fundus image, without reading any pixel data.
+
+            Returns:
+                list of dict: One row per image with its type ('oct' or 'fundus'), num_slices, width and height.
+        """
+        rows = []
+        f = self.file
+        for chunk_name, structure, kind in ((self.oct_chunk_name(), self.oct_header, 'oct'),
+                                            (b'@IMG_OBS', self.fundus_header, 'fundus')):
+            if chunk_name not in self.chunk_dict:
+                continue
+            if chunk_name == b'@IMG_JPEG':
+                structure = self.jpeg_header
+            chunk_location, chunk_size = self.chunk_dict[chunk_name]
+            f.seek(chunk_location)
+            header = structures.parse(structure, f.read(structure.itemsize))
+            rows.append({'type': kind,
+                         'num_slices': int(header.number_slices),
+                         'width': int(header.width),
+                         'height': int(header.height)})
+        return rows
+
+    def read_all(self):
+        """ Reads the OCT volume, the fundus image and all other chunks in a single pass over the file.
+
+            Notes:
+                The time spent on each type of chunk is added to timings, under 'oct', 'fundus' and 'other'.
+
+            Returns:
+                dict: 'oct' (obj:OCTVolumeWithMetaData) and 'fundus' (obj:FundusImageWithMetaData), None when
+                missing from the file, and 'chunks', the raw bytes of every other chunk by name.
+        """
+        readers = {self.oct_chunk_name(): ('oct', self.read_oct_volume),
+                   b'@IMG_OBS': ('fundus', self.read_fundus_image)}
+        data = {'oct': None, 'fundus': None, 'chunks': {}}
+        for chunk_name, (chunk_location, chunk_size) in sorted(self.chunk_dict.items(), key=lambda item: item[1][0]):
+            start = time.perf_counter()
+            if chunk_name in readers:
+                kind, reader = readers[chunk_name]
+                data[kind] = reader()
+            else:
+                kind = 'other'
+                self.file.seek(chunk_location)
+                data['chunks'][chunk_name] = self.file.read(chunk_size)
+            self.timings[kind] = self.timings.get(kind, 0) + time.perf_counter() - start
+        return data
+
+    def oct_chunk_name(self):
+        """ Name of the chunk the OCT volume is read from: @IMG_SCAN_03, or @IMG_JPEG if the file has no raw volume. """
+        if b'@IMG_SCAN_03' not in self.chunk_dict and b'@IMG_JPEG' in self.chunk_dict:
+            return b'@IMG_JPEG'
+        return b'@IMG_SCAN_03'
+
     def read_oct_volume(self):
         """ Reads OCT data.
 
             Returns:
                 obj:OCTVolumeWithMetaData
         """
+        if self.oct_chunk_name() == b'@IMG_JPEG':
+            return self.read_jpeg_volume()
         if b'@IMG_SCAN_03' not in self.chunk_dict:
             raise ValueError('Could not find OCT header @IMG_SCAN_03 in chunk list')
-        with open(self.filepath, 'rb') as f:
-            chunk_location, chunk_size = self.chunk_dict[b'@IMG_SCAN_03']
-            f.seek(chunk_location)
-            raw = f.read(22)
-            oct_header = self.oct_header.parse(raw)
-            number_pixels = oct_header.width * oct_header.height * oct_header.number_slices
-            raw_volume = np.fromstring(f.read(number_pixels * 2), dtype=np.uint16)
-            volume = np.array(raw_volume)
-            volume = volume.reshape(oct_header.width, oct_header.height, oct_header.number_slices, order='F')
-            volume = np.transpose(volume, [1, 0, 2])
-        oct_volume = OCTVolumeWithMetaData([volume[:, :, i] for i in range(volume.shape[2])])
+        f = self.file
+        chunk_location, chunk_size = self.chunk_dict[b'@IMG_SCAN_03']
+        f.seek(chunk_location)
+        raw = f.read(self.oct_header.itemsize)
+        oct_header = structures.parse(self.oct_header, raw)
+        number_pixels = int(oct_header.width) * int(oct_header.height) * int(oct_header.number_slices)
+        if self.use_mmap:
+            raw_volume = np.memmap(self.filepath, dtype='<u2', mode='r', shape=(number_pixels,),
+                                   offset=chunk_location + self.oct_header.itemsize)
+        else:
+            raw_volume = np.fromfile(f, dtype='<u2', count=number_pixels)
+        volume = raw_volume.reshape(oct_header.width, oct_header.height, oct_header.number_slices, order='F')
+        volume = np.transpose(volume, [1, 0, 2])
+        # slices first, which is a contiguous view of the raw volume
+        oct_volume = OCTVolumeWithMetaData(np.moveaxis(volume, 2, 0))
+        return oct_volume
+
+    def read_jpeg_volume(self):
+        """ Reads OCT data stored as one JPEG per b-scan, decoding the b-scans on a pool of threads.
+
+            Notes:
+                Each b-scan is a u4 size followed by its JPEG data. B-scans that fail to decode are left as zeros
+                and flagged as missing.
+
+            Returns:
+                obj:OCTVolumeWithMetaData, of type uint8.
+        """
+        import cv2
+        if b'@IMG_JPEG' not in self.chunk_dict:
+            raise ValueError('Could not find OCT header @IMG_JPEG in chunk list')
+        f = self.file
+        chunk_location, chunk_size = self.chunk_dict[b'@IMG_JPEG']
+        f.seek(chunk_location)
+        raw = f.read(chunk_size)
+        jpeg_header = structures.parse(self.jpeg_header, raw)
+        number_slices = int(jpeg_header.number_slices)
+        shape = (int(jpeg_header.height), int(jpeg_header.width))
+
+        # the sizes have to be walked through sequentially, the JPEG data itself is only sliced
+        buffer = memoryview(raw)
+        jpegs = []
+        offset = self.jpeg_header.itemsize
+        for _ in range(number_slices):
+            size = struct.unpack_from('<I', raw, offset)[0]
+            offset += 4
+            jpegs.append(buffer[offset:offset + size])
+            offset += size
+
+        oct_volume = OCTVolumeWithMetaData.empty(number_slices, shape, dtype=np.uint8)
+
+        def decode(index):
+            image = cv2.imdecode(np.frombuffer(jpegs[index], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if image is not None and image.shape == shape:
+                oct_volume.set_slice(index, image)
+
+        if self.workers > 1:
+            # cv2.imdecode releases the GIL, so the b-scans are decoded concurrently
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                list(executor.map(decode, range(number_slices)))
+        else:
+            for index in range(number_slices):
+                decode(index)
         return oct_volume
 
     def read_fundus_image(self):
@@ -102,17 +217,16 @@ class FDS(object):
         """
         if b'@IMG_OBS' not in self.chunk_dict:
             raise ValueError('Could not find OCT header @IMG_OBS in chunk list')
-        with open(self.filepath, 'rb') as f:
-            chunk_location, chunk_size = self.chunk_dict[b'@IMG_OBS']
-            f.seek(chunk_location)
-            raw = f.read(21)
-            fundus_header = self.fundus_header.parse(raw)
-            #number_pixels = fundus_header.width * fundus_header.height * fundus_header.number_slices
-            raw_image = np.fromstring(f.read(fundus_header.size), dtype=np.uint8)
-            #raw_image = [struct.unpack('B', f.read(1)) for pixel in range(fundus_header.size)]
-            image = np.array(raw_image)
-            image = image.reshape(3, fundus_header.width, fundus_header.height, order='F')
-            image = np.transpose(image, [2, 1, 0])
-            image = image.astype(np.float32)
+        f = self.file
+        chunk_location, chunk_size = self.chunk_dict[b'@IMG_OBS']
+        f.seek(chunk_location)
+        raw = f.read(self.fundus_header.itemsize)
+        fundus_header = structures.parse(self.fundus_header, raw)
+        #number_pixels = fundus_header.width * fundus_header.height * fundus_header.number_slices
+        raw_image = np.fromfile(f, dtype=np.uint8, count=fundus_header['size'])
+        #raw_image = [struct.unpack('B', f.read(1)) for pixel in range(fundus_header.size)]
+        image = raw_image.reshape(3, fundus_header.width, fundus_header.height, order='F')
+        image = np.transpose(image, [2, 1, 0])
+        image = image.astype(np.float32)
         fundus_image = FundusImageWithMetaData(image)
         return fundus_image
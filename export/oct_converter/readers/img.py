@@ -1,32 +1,60 @@
+import os
 import numpy as np
 from ..image_types import OCTVolumeWithMetaData
 
+# (rows, cols, num_slices) of the known scans, by file size. Rows are the depth of each a-scan.
+GEOMETRIES = {
+    1024 * 512 * 128: (1024, 512, 128),  # Cirrus 512x128 cube
+    1024 * 200 * 200: (1024, 200, 200),  # Cirrus 200x200 cube
+}
+
 
 class IMG(object):
     """ Class for extracting data from Zeiss's .img file format.
 
         Attributes:
             filepath (str): Path to .img file for reading.
+            geometry (tuple): (rows, cols, num_slices) of the scan. Inferred from the file size if None.
+            interlaced (bool): Each stored b-scan holds two b-scans, one per half of its rows.
     """
 
-    def __init__(self, filepath):
+    def __init__(self, filepath, geometry=None, interlaced=True):
         self.filepath = filepath
+        self.geometry = geometry
+        self.interlaced = interlaced
+
+    def scan_geometry(self):
+        """ Geometry of the scan, as given on creation or looked up from the file size.
+
+            Returns:
+                tuple: (rows, cols, num_slices)
+        """
+        if self.geometry is not None:
+            return tuple(self.geometry)
+        file_size = os.path.getsize(self.filepath)
+        if file_size not in GEOMETRIES:
+            raise ValueError('Unknown scan geometry for a file of {} bytes, it has to be given'.format(file_size))
+        return GEOMETRIES[file_size]
 
     def read_oct_volume(self):
         """ Reads OCT data.
 
+            Notes:
+                The file is memory mapped, and de-interlaced with a single copy into a uint8 volume.
+
             Returns:
                 obj:OCTVolumeWithMetaData
         """
-        with open(self.filepath, 'rb') as f:
-            volume = np.fromstring(f.read(), dtype=np.uint8)
-            volume = volume.reshape((1024, 512, 128), order='F')
-            shape = volume.shape
-            # volume = np.transpose(volume, [2, 1, 0])
-
-            interlaced = np.zeros((int(shape[0] / 2), shape[1], shape[2] * 2))
-            interlaced[..., 0::2] = volume[:512, ...]
-            interlaced[..., 1::2] = volume[512:, ...]
-            interlaced = np.rot90(interlaced, axes=(0, 1))
-        oct_volume = OCTVolumeWithMetaData([interlaced[:, :, i] for i in range(interlaced.shape[2])])
+        rows, cols, num_slices = self.scan_geometry()
+        # a-scans are contiguous, b-scans are the slowest axis
+        raw = np.memmap(self.filepath, dtype=np.uint8, mode='r', shape=(num_slices, cols, rows)).view(np.ndarray)
+        # columns are flipped, as the volume used to be rotated by 90 degrees
+        raw = raw[:, ::-1]
+        if self.interlaced:
+            # the first half of the rows of a stored b-scan is an even b-scan, the second half the next odd one
+            raw = raw.reshape(num_slices, cols, 2, rows // 2).transpose(0, 2, 1, 3)
+            volume = raw.reshape(num_slices * 2, cols, rows // 2)
+        else:
+            volume = np.array(raw)
+        oct_volume = OCTVolumeWithMetaData(volume)
         return oct_volume
@@ -0,0 +1,111 @@
+import hashlib
+import os
+import numpy as np
+from .e2e import E2E, INDEX_DTYPE
+
+# layout of the indexes, stored in every entry so that entries of another layout are treated as stale
+INDEX_LAYOUT = str(INDEX_DTYPE.descr)
+
+
+class IndexCache(object):
+    """ On-disk cache of E2E chunk indexes, so that directories are only traversed once per file.
+
+        Notes:
+            Each file gets one .npz entry holding its chunk index next to its path, size, modification time and the
+            layout of INDEX_DTYPE. An entry is only used while the file still has the same size and modification
+            time, and INDEX_DTYPE the same layout.
+
+        Attributes:
+            folder (str): Folder in which the entries are stored.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def entry_path(self, filepath):
+        """ Location of the entry of a file in the cache. """
+        key = hashlib.sha1(os.path.abspath(filepath).encode('utf-8')).hexdigest()
+        return os.path.join(self.folder, key + '.npz')
+
+    def get(self, filepath):
+        """ Reads the cached index of a file.
+
+            Args:
+                filepath (str): Path of the E2E file.
+
+            Returns:
+                np.recarray, or None if the file has no entry or its entry is stale.
+        """
+        entry_path = self.entry_path(filepath)
+        if not os.path.exists(entry_path):
+            return None
+        with np.load(entry_path) as entry:
+            if is_stale(entry, filepath):
+                return None
+            return entry['index'].view(np.recarray)
+
+    def put(self, filepath, index):
+        """ Stores the index of a file, replacing any previous entry.
+
+            Args:
+                filepath (str): Path of the E2E file.
+                index (np.recarray): Chunk index of the file, as built by E2E.build_index.
+        """
+        entry_path = self.entry_path(filepath)
+        tmp_path = '{}.{}.tmp'.format(entry_path, os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, index=np.asarray(index), stat=file_stat(filepath),
+                     source=np.array([os.path.abspath(filepath)]), layout=np.array([INDEX_LAYOUT]))
+        os.replace(tmp_path, entry_path)
+
+    def prune(self):
+        """ Removes the entries of files that were deleted or modified since they were indexed, and the entries of
+            another INDEX_DTYPE layout.
+
+            Returns:
+                list of str: Paths of the files whose entries were removed.
+        """
+        removed = []
+        for name in os.listdir(self.folder):
+            if not name.endswith('.npz'):
+                continue
+            entry_path = os.path.join(self.folder, name)
+            with np.load(entry_path) as entry:
+                source = str(entry['source'][0])
+                stale = is_stale(entry, source)
+            if stale:
+                os.remove(entry_path)
+                removed.append(source)
+        return removed
+
+    def rebuild(self, filepaths, force=False):
+        """ Indexes files whose entries are missing or stale.
+
+            Args:
+                filepaths (list of str): Paths of the E2E files.
+                force (bool): Re-index every file, even if its entry is up to date.
+
+            Returns:
+                list of str: Paths of the files that were indexed.
+        """
+        indexed = []
+        for filepath in filepaths:
+            if force or self.get(filepath) is None:
+                self.put(filepath, E2E(filepath).build_index())
+                indexed.append(filepath)
+        return indexed
+
+
+def is_stale(entry, filepath):
+    """ Whether a cache entry no longer matches its file, which was deleted or modified, or INDEX_DTYPE. """
+    if 'layout' not in entry.files or str(entry['layout'][0]) != INDEX_LAYOUT:
+        return True
+    return not os.path.exists(filepath) or not np.array_equal(entry['stat'], file_stat(filepath))
+
+
+def file_stat(filepath):
+    """ Size and modification time (ns) of a file. """
+    stat = os.stat(filepath)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
@@ -0,0 +1,145 @@
+""" Binary layouts of the headers found in .e2e and .fds files, as NumPy structured dtypes.
+
+    Notes:
+        All fields are little-endian. Strings are null padded bytes, see to_str.
+"""
+import numpy as np
+
+E2E_HEADER = np.dtype([
+    ('magic', 'S12'),
+    ('version', '<u4'),
+    ('unknown', '<u2', (10,)),
+])
+
+E2E_MAIN_DIRECTORY = np.dtype([
+    ('magic', 'S12'),
+    ('version', '<u4'),
+    ('unknown', '<u2', (10,)),
+    ('num_entries', '<u4'),
+    ('current', '<u4'),
+    ('prev', '<u4'),
+    ('unknown3', '<u4'),
+])
+
+E2E_SUB_DIRECTORY = np.dtype([
+    ('pos', '<u4'),
+    ('start', '<u4'),
+    ('size', '<u4'),
+    ('unknown', '<u4'),
+    ('patient_id', '<u4'),
+    ('study_id', '<u4'),
+    ('series_id', '<u4'),
+    ('slice_id', '<i4'),
+    ('unknown2', '<u2'),
+    ('unknown3', '<u2'),
+    ('type', '<u4'),
+    ('unknown4', '<u4'),
+])
+
+E2E_CHUNK = np.dtype([
+    ('magic', 'S12'),
+    ('unknown', '<u4'),
+    ('unknown2', '<u4'),
+    ('pos', '<u4'),
+    ('size', '<u4'),
+    ('unknown3', '<u4'),
+    ('patient_id', '<u4'),
+    ('study_id', '<u4'),
+    ('series_id', '<u4'),
+    ('slice_id', '<i4'),
+    ('ind', '<u2'),
+    ('unknown4', '<u2'),
+    ('type', '<u4'),
+    ('unknown5', '<u4'),
+])
+
+E2E_IMAGE = np.dtype([
+    ('size', '<u4'),
+    ('type', '<u4'),
+    ('unknown', '<u4'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+])
+
+E2E_PATIENT = np.dtype([
+    ('name', 'S31'),
+    ('surname', 'S66'),
+    ('birthdate', '<u4'),
+    ('sex', 'S1'),
+])
+
+E2E_LATERALITY = np.dtype([
+    ('unknown', 'u1', (14,)),
+    ('laterality', 'S1'),
+])
+
+FDS_HEADER = np.dtype([
+    ('FOCT', 'S4'),
+    ('FDA', 'S3'),
+    ('version_info_1', '<u4'),
+    ('version_info_2', '<u4'),
+])
+
+FDS_OCT_HEADER = np.dtype([
+    ('unknown', 'S1'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('bits_per_pixel', '<u4'),
+    ('number_slices', '<u4'),
+    ('unknown2', 'S1'),
+    ('size', '<u4'),
+])
+
+FDS_FUNDUS_HEADER = np.dtype([
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('bits_per_pixel', '<u4'),
+    ('number_slices', '<u4'),
+    ('unknown', 'S1'),
+    ('size', '<u4'),
+])
+
+FDS_JPEG_HEADER = np.dtype([
+    ('type', 'u1'),
+    ('unknown', '<u4'),
+    ('unknown2', '<u4'),
+    ('width', '<u4'),
+    ('height', '<u4'),
+    ('number_slices', '<u4'),
+    ('unknown3', '<u4'),
+])
+
+
+def parse(structure, raw):
+    """ Parses a single header.
+
+    Notes:
+        Fields sharing their name with a NumPy attribute, such as size, must be accessed as record['size'].
+
+    Args:
+        structure (np.dtype): Layout of the header.
+        raw (bytes): At least structure.itemsize bytes.
+
+    Returns:
+        np.record
+    """
+    return np.frombuffer(raw, dtype=structure, count=1).view(np.recarray)[0]
+
+
+def parse_array(structure, raw, count):
+    """ Parses a block of consecutive headers, e.g. all the entries of a directory, in one call.
+
+    Args:
+        structure (np.dtype): Layout of each header.
+        raw (bytes): At least count * structure.itemsize bytes.
+        count (int): Number of headers.
+
+    Returns:
+        np.recarray
+    """
+    return np.frombuffer(raw, dtype=structure, count=count).view(np.recarray)
+
+
+def to_str(value):
+    """ Decodes a null padded ascii field. """
+    return value.decode('ascii')
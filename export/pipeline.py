@@ -0,0 +1,172 @@
+import queue
+import threading
+import time
+
+# marks the end of the items of a queue
+END = object()
+
+
+class Stage:
+    """
+    Step of a Pipeline, run by its own pool of threads
+    """
+    def __init__(self, name, function, workers=1, queue_size=8):
+        """
+        :param name: Name of the stage in the statistics
+        :param function: Called on each item of the stage, returns an iterable (possibly a generator) of the items,
+        which cannot be None, passed on to the next stage
+        :param workers: Number of threads running the stage
+        :param queue_size: Number of items waiting for the stage at most. Previous stages block when it is full
+        """
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.items = 0
+        self.busy = 0.
+        self.depth_sum = 0
+        self.depth_count = 0
+        self.max_depth = 0
+
+    def stats(self, duration):
+        """
+        :return: Number of items processed, share of the stage's thread time spent working rather than waiting for
+        items or for room in the next queue, and the mean and max number of items waiting for the stage
+        """
+        return {'workers': self.workers,
+                'items': self.items,
+                'utilisation': self.busy / (self.workers * duration) if duration > 0 else 0.,
+                'mean_queue': self.depth_sum / self.depth_count if self.depth_count else 0.,
+                'max_queue': self.max_depth}
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages concurrently, connected by bounded queues so that a slow stage holds
+    back the ones before it and memory stays bounded. cv2, NumPy and file I/O release the GIL, so threads are
+    enough to overlap reading, decoding, encoding and writing
+    """
+    def __init__(self, stages, on_error=None):
+        """
+        :param stages: list of Stage, in order
+        :param on_error: Called with the stage, item and exception when a stage fails on an item, which is then
+        dropped. The exception is raised at the end of the run if None
+        """
+        self.stages = stages
+        self.on_error = on_error
+        self.errors = []
+
+    def run(self, items):
+        """
+        Feeds items to the first stage and waits for the last one to process all of them
+        :return: Statistics of each stage by name, see Stage.stats, and the total 'duration' in seconds
+        """
+        start = time.perf_counter()
+        threads = []
+        for i, stage in enumerate(self.stages):
+            next_stage = self.stages[i + 1] if i + 1 < len(self.stages) else None
+            done = [0]
+            for _ in range(stage.workers):
+                thread = threading.Thread(target=self._work, args=(stage, next_stage, done), daemon=True)
+                thread.start()
+                threads.append(thread)
+        for item in items:
+            self.stages[0].queue.put(item)
+        self.stages[0].queue.put(END)
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+        if self.errors and self.on_error is None:
+            raise self.errors[0][2]
+        stats = {stage.name: stage.stats(duration) for stage in self.stages}
+        stats['duration'] = duration
+        return stats
+
+    def _work(self, stage, next_stage, done):
+        while True:
+            depth = stage.queue.qsize()
+            with stage.lock:
+                stage.depth_sum += depth
+                stage.depth_count += 1
+                stage.max_depth = max(stage.max_depth, depth)
+            item = stage.queue.get()
+            if item is END:
+                with stage.lock:
+                    done[0] += 1
+                    last = done[0] == stage.workers
+                if last:
+                    if next_stage is not None:
+                        next_stage.queue.put(END)
+                else:
+                    # wake up the other threads of the stage
+                    stage.queue.put(END)
+                return
+            outputs = self._call(stage, item, lambda: iter(stage.function(item)))
+            while outputs is not None:
+                output = self._call(stage, item, lambda: next(outputs, END))
+                if output is None or output is END:
+                    break
+                # time spent blocked on a full queue is not counted as work
+                if next_stage is not None:
+                    next_stage.queue.put(output)
+            with stage.lock:
+                stage.items += 1
+
+    def _call(self, stage, item, function):
+        """ Runs part of a stage on an item, timing it. Returns None if it failed """
+        tic = time.perf_counter()
+        try:
+            return function()
+        except Exception as e:
+            self.errors.append((stage, item, e))
+            if self.on_error is not None:
+                self.on_error(stage, item, e)
+        finally:
+            with stage.lock:
+                stage.busy += time.perf_counter() - tic
+
+
+def image_stages(extension, png_compression=None, encoders=1, writers=1, queue_size=8, on_written=None):
+    """
+    Last stages of an export to images: encoding (key, filename, image) items with cv2.imencode, then writing them
+    :param extension: Extension of the images, e.g. '.png'
+    :param png_compression: Compression level of .png images, see write_images
+    :param encoders: Number of threads encoding images
+    :param writers: Number of threads writing images
+    :param on_written: Called with the key and filename of each image once written
+    :return: list of Stage
+    """
+    import cv2
+    params = [] if png_compression is None or extension.lower() != '.png' else \
+        [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+
+    def encode(item):
+        key, filename, image = item
+        success, buffer = cv2.imencode(extension, image, params)
+        if not success:
+            raise IOError('Could not encode {}'.format(filename))
+        return [(key, filename, buffer)]
+
+    def write(item):
+        key, filename, buffer = item
+        with open(filename, 'wb') as f:
+            f.write(buffer)
+        if on_written is not None:
+            on_written(key, filename)
+        return []
+
+    return [Stage('encode', encode, encoders, queue_size), Stage('write', write, writers, queue_size)]
+
+
+def format_stats(stats):
+    """ Table of the statistics of a run, one line per stage """
+    lines = ['%-8s %7s %7s %11s %10s %9s' % ('stage', 'workers', 'items', 'utilisation', 'mean queue', 'max queue')]
+    for name, stage in stats.items():
+        if name == 'duration':
+            continue
+        lines.append('%-8s %7i %7i %10.0f%% %10.1f %9i' % (name, stage['workers'], stage['items'],
+                                                          100 * stage['utilisation'], stage['mean_queue'],
+                                                          stage['max_queue']))
+    lines.append('%.2f s' % stats['duration'])
+    return '\n'.join(lines)
@@ -0,0 +1,127 @@
+import importlib.util
+import io
+import time
+import numpy as np
+from oct_converter.image_types.oct import IMAGE_TYPES, VOLUME_TYPES
+from oct_converter.image_types.montage import to_uint8
+
+
+def estimated_formats(extension):
+    """ Formats whose output size is estimated: the one exported to first, then the other supported ones """
+    formats = ['.png', '.npy'] + (['.h5'] if importlib.util.find_spec('h5py') is not None else [])
+    return [extension] + [f for f in formats if f != extension.lower()]
+
+
+def encoded_size(image, extension, png_compression=None):
+    """
+    Size of an image once saved with an extension, encoded in memory so that nothing is written
+    :param extension: An image format, .npy, or a volume format in which case the image is a slice of the volume, see
+    write_hdf5
+    :return: Number of bytes
+    """
+    extension = extension.lower()
+    if extension in IMAGE_TYPES:
+        import cv2
+        params = [] if png_compression is None or extension != '.png' else \
+            [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        success, buffer = cv2.imencode(extension, image, params)
+        if not success:
+            raise IOError('Could not encode an image as {}'.format(extension))
+        return len(buffer)
+    if extension == '.npy':
+        return image.nbytes
+    if extension in VOLUME_TYPES:
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('Estimating the size of volume files requires h5py')
+        with h5py.File(io.BytesIO(), 'w') as f:
+            dataset = f.create_dataset('data', data=image[np.newaxis], chunks=(1,) + image.shape,
+                                       compression='gzip', compression_opts=4, shuffle=True)
+            return dataset.id.get_storage_size()
+    raise NotImplementedError('Saving with file extension {} not supported'.format(extension))
+
+
+def calibrate(images, extensions, png_compression=None, dtypes=None):
+    """
+    Measures the throughput of an export on a sample of images
+    :param images: Iterable of the images of the sample, timed while they are read and decoded
+    :param extensions: Formats whose output size is estimated. Only the time spent encoding to the first one, the
+    format exported to, is counted
+    :param dtypes: Type the images are saved as by extension, when it differs from the type of the sample
+    :return: Seconds spent reading and encoding per pixel, and bytes written per pixel by extension
+    """
+    pixels, seconds = 0, 0.
+    sizes = dict.fromkeys(extensions, 0)
+    images = iter(images)
+    while True:
+        tic = time.perf_counter()
+        image = next(images, None)
+        if image is None:
+            break
+        sizes[extensions[0]] += encoded_size(image, extensions[0], png_compression)
+        seconds += time.perf_counter() - tic
+        for extension in extensions[1:]:
+            dtype = (dtypes or {}).get(extension)
+            if dtype is not None and dtype != image.dtype:
+                converted = to_uint8(image) if dtype == np.uint8 else image.astype(dtype)
+            else:
+                converted = image
+            sizes[extension] += encoded_size(converted, extension, png_compression)
+        pixels += image.size
+    if pixels == 0:
+        return 0., dict.fromkeys(extensions, 0.)
+    return seconds / pixels, {extension: size / pixels for extension, size in sizes.items()}
+
+
+def summarize(rows, seconds_per_pixel, bytes_per_pixel, workers=1):
+    """
+    Totals of an export plan, per patient and overall
+    :param rows: One dict per volume, with its patient, source file, num_slices exported, height and width
+    :param seconds_per_pixel: See calibrate
+    :param bytes_per_pixel: Bytes written per pixel by extension, see calibrate
+    :param workers: Number of volumes exported in parallel, assuming the throughput grows with it
+    :return: dict with the totals of each 'patients' by name and the 'total' ones: number of files, volumes, slices,
+    pixels, estimated 'bytes' written by extension and estimated seconds
+    """
+    def totals(rows):
+        pixels = sum(row['num_slices'] * row['height'] * row['width'] for row in rows)
+        return {'files': len(set(row['source'] for row in rows)),
+                'volumes': len(rows),
+                'slices': sum(row['num_slices'] for row in rows),
+                'pixels': pixels,
+                'bytes': {extension: int(pixels * ratio) for extension, ratio in bytes_per_pixel.items()},
+                'seconds': pixels * seconds_per_pixel / max(workers, 1)}
+
+    patients = {}
+    for row in rows:
+        patients.setdefault(row['patient'], []).append(row)
+    return {'patients': {patient: totals(rows) for patient, rows in sorted(patients.items())},
+            'total': totals(rows)}
+
+
+def format_bytes(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024.
+    return '%.1f TB' % size
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%i:%02i:%02i' % (hours, minutes, seconds)
+
+
+def format_plan(summary):
+    """ Table of the totals of an export plan, one line per patient and a total line """
+    extensions = list(summary['total']['bytes'])
+    line = '%-40s %6s %8s %8s' + ' %10s' * len(extensions) + ' %10s'
+    lines = [line % tuple(['patient', 'files', 'volumes', 'slices'] + extensions + ['time'])]
+    rows = list(summary['patients'].items()) + [('total', summary['total'])]
+    for name, entry in rows:
+        lines.append(line % tuple([name[:40], entry['files'], entry['volumes'], entry['slices']] +
+                                  [format_bytes(entry['bytes'][extension]) for extension in extensions] +
+                                  [format_duration(entry['seconds'])]))
+    return '\n'.join(lines)
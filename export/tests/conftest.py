@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the exporters and oct_converter are imported from the export folder, as when running its scripts
+EXPORT_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if EXPORT_FOLDER not in sys.path:
+    sys.path.insert(0, EXPORT_FOLDER)
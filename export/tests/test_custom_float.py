@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from oct_converter.readers.e2e import BSCAN_TYPES, GAMMA, custom_float_table, read_custom_float
+
+WORDS = np.arange(pow(2, 16), dtype=np.uint32)
+
+
+def reference_table():
+    """ The per-pixel decoding the lookup tables replaced, for all 65536 words """
+    return np.array([256 * read_custom_float(int(word).to_bytes(2, 'little')) ** GAMMA for word in WORDS])
+
+
+@pytest.fixture(scope='module')
+def reference():
+    return reference_table()
+
+
+def test_float64_table_is_bit_exact(reference):
+    table = custom_float_table(np.float64)
+    assert table.shape == (pow(2, 16),)
+    assert np.array_equal(table, reference)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_integer_tables_round_and_saturate(reference, dtype):
+    info = np.iinfo(dtype)
+    expected = np.clip(np.rint(reference), info.min, info.max).astype(dtype)
+    assert np.array_equal(custom_float_table(dtype), expected)
+
+
+def test_float32_table(reference):
+    assert np.array_equal(custom_float_table(np.float32), reference.astype(np.float32))
+
+
+def test_tables_are_cached_and_read_only():
+    for dtype in BSCAN_TYPES:
+        table = custom_float_table(dtype)
+        assert table is custom_float_table(dtype)
+        assert not table.flags.writeable
+
+
+def test_unsupported_dtype():
+    with pytest.raises(ValueError):
+        custom_float_table(np.int64)
@@ -0,0 +1,167 @@
+import numpy as np
+import pytest
+
+pydicom = pytest.importorskip('pydicom')
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.uid import ExplicitVRLittleEndian, ImplicitVRLittleEndian, RLELossless, generate_uid
+from oct_converter.readers import Dicom
+
+# SOP classes of the ophthalmic tomography and photography images
+OPT_CLASS = '1.2.840.10008.5.1.4.1.1.77.1.5.4'
+OP_CLASS = '1.2.840.10008.5.1.4.1.1.77.1.5.1'
+
+
+def write_dcm(filepath, pixels, modality, series_uid, instance=1, syntax=ExplicitVRLittleEndian, laterality='R'):
+    """
+    Writes a synthetic DICOM file
+    :param pixels: (num_frames, rows, cols) array of an OCT file, (rows, cols) of a single frame, or (rows, cols, 3)
+    of an RGB fundus
+    :param syntax: Transfer syntax of the file, the pixel data being encoded with pydicom if compressed
+    """
+    meta = FileMetaDataset()
+    meta.MediaStorageSOPClassUID = OPT_CLASS if modality == 'OPT' else OP_CLASS
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.SOPClassUID = meta.MediaStorageSOPClassUID
+    ds.SOPInstanceUID = meta.MediaStorageSOPInstanceUID
+    ds.Modality = modality
+    ds.StudyInstanceUID = '1.2.3'
+    ds.SeriesInstanceUID = series_uid
+    ds.SeriesNumber = 7
+    ds.InstanceNumber = instance
+    ds.PatientID = 'P1'
+    ds.PatientName = 'Doe^John'
+    ds.PatientBirthDate = '19700101'
+    ds.ImageLaterality = laterality
+    rgb = modality == 'OP' and pixels.ndim == 3
+    if rgb:
+        ds.Rows, ds.Columns = pixels.shape[:2]
+        ds.SamplesPerPixel = 3
+        ds.PhotometricInterpretation = 'RGB'
+        ds.PlanarConfiguration = 0
+    else:
+        ds.Rows, ds.Columns = pixels.shape[-2:]
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        if pixels.ndim == 3:
+            ds.NumberOfFrames = len(pixels)
+    ds.BitsAllocated = pixels.dtype.itemsize * 8
+    ds.BitsStored = ds.BitsAllocated
+    ds.HighBit = ds.BitsAllocated - 1
+    ds.PixelRepresentation = 0
+    ds.PixelData = pixels.tobytes()
+    if syntax == RLELossless:
+        ds.compress(RLELossless)
+    else:
+        ds.file_meta.TransferSyntaxUID = syntax
+    ds.save_as(str(filepath), enforce_file_format=True)
+
+
+@pytest.fixture(scope='module')
+def export(tmp_path_factory):
+    """
+    Folder with a multi-frame explicit VR OCT file, an OCT series of per-frame implicit VR files written out of order,
+    an RLE compressed OCT file and an RGB fundus
+    :return: Folder and the arrays written, by SeriesInstanceUID
+    """
+    root = tmp_path_factory.mktemp('dcm')
+    rng = np.random.default_rng(0)
+    arrays = {'1.1': rng.integers(0, 65535, (5, 40, 30), dtype=np.uint16),
+              '1.2': rng.integers(0, 255, (20, 25, 3), dtype=np.uint8),
+              '1.3': rng.integers(0, 255, (4, 16, 12), dtype=np.uint8),
+              '1.4': rng.integers(0, 65535, (3, 10, 8), dtype=np.uint16)}
+    write_dcm(root / 'multi.dcm', arrays['1.1'], 'OPT', '1.1')
+    write_dcm(root / 'fundus.dcm', arrays['1.2'], 'OP', '1.2', laterality='L')
+    (root / 'frames').mkdir()
+    # file names sort in another order than the instance numbers, which give the order of the frames
+    for name, index in zip('abcd', [2, 0, 3, 1]):
+        write_dcm(root / 'frames' / (name + '.dcm'), arrays['1.3'][index], 'OPT', '1.3', instance=index + 1,
+                  syntax=ImplicitVRLittleEndian)
+    write_dcm(root / 'rle.dcm', arrays['1.4'], 'OPT', '1.4', syntax=RLELossless)
+    return root, arrays
+
+
+def test_list_volumes(export):
+    root, arrays = export
+    volumes = {descriptor['key']: descriptor for descriptor in Dicom(str(root)).list_volumes()}
+    assert sorted(volumes) == sorted(arrays)
+    assert [volumes[key]['type'] for key in sorted(volumes)] == ['oct', 'fundus', 'oct', 'oct']
+    assert [volumes[key]['num_slices'] for key in sorted(volumes)] == [5, 1, 4, 3]
+    assert (volumes['1.1']['height'], volumes['1.1']['width']) == (40, 30)
+    assert volumes['1.2']['laterality'] == 'L'
+    assert volumes['1.1']['series_id'] == 7
+
+
+def test_list_volumes_filters(export):
+    root, arrays = export
+    reader = Dicom(str(root))
+    assert [d['key'] for d in reader.list_volumes(types=['fundus'])] == ['1.2']
+    assert sorted(d['key'] for d in reader.list_volumes(laterality='R')) == ['1.1', '1.3', '1.4']
+    assert reader.list_volumes(series=[8]) == []
+
+
+def test_scan_metadata(export):
+    root, arrays = export
+    for descriptor in Dicom(str(root)).scan_metadata():
+        assert (descriptor['patient_name'], descriptor['patient_surname']) == ('John', 'Doe')
+        assert descriptor['patient_id'] == 'P1'
+
+
+def test_multi_frame_is_memory_mapped(export):
+    root, arrays = export
+    volume = Dicom(str(root)).read_volume('1.1')
+    assert isinstance(volume.volume, np.memmap)
+    assert np.array_equal(volume.volume, arrays['1.1'])
+    assert (volume.laterality, volume.patient_id, volume.DOB) == ('R', 'P1', '19700101')
+
+
+def test_multi_frame_without_mmap(export):
+    root, arrays = export
+    volume = Dicom(str(root), use_mmap=False).read_volume('1.1')
+    assert not isinstance(volume.volume, np.memmap)
+    assert np.array_equal(volume.volume, arrays['1.1'])
+
+
+def test_frames_follow_instance_number(export):
+    root, arrays = export
+    reader = Dicom(str(root))
+    assert np.array_equal(reader.read_volume('1.3').volume, arrays['1.3'])
+    for index, frame in enumerate(reader.iter_frames('1.3')):
+        assert np.array_equal(frame, arrays['1.3'][index])
+
+
+def test_compressed(export):
+    root, arrays = export
+    volume = Dicom(str(root)).read_volume('1.4')
+    assert np.array_equal(volume.volume, arrays['1.4'])
+
+
+@pytest.mark.parametrize('key', ['1.1', '1.3', '1.4'])
+def test_read_frame(export, key):
+    root, arrays = export
+    reader = Dicom(str(root))
+    for index in [2, 0, 1]:
+        assert np.array_equal(reader.read_frame(key, index), arrays[key][index])
+
+
+def test_rgb_fundus_as_bgr(export):
+    root, arrays = export
+    images = Dicom(str(root)).read_fundus_image()
+    assert len(images) == 1
+    assert np.array_equal(images[0].image, arrays['1.2'][..., ::-1])
+    assert images[0].laterality == 'L'
+
+
+def test_read_oct_volume(export):
+    root, arrays = export
+    volumes = Dicom(str(root)).read_oct_volume()
+    assert sorted(v.num_slices for v in volumes) == [3, 4, 5]
+
+
+def test_single_file(export):
+    root, arrays = export
+    reader = Dicom(str(root / 'multi.dcm'))
+    assert [d['key'] for d in reader.list_volumes()] == ['1.1']
+    assert np.array_equal(reader.read_volume('1.1').volume, arrays['1.1'])
@@ -0,0 +1,111 @@
+import gc
+import struct
+import numpy as np
+import pytest
+from oct_converter.image_types.oct import save_slices
+from oct_converter.readers import E2E
+from oct_converter.readers.e2e import IMAGE_CHUNK, PATIENT_CHUNK, LATERALITY_CHUNK, custom_float_table
+
+WIDTH, HEIGHT = 12, 8
+
+
+def write_e2e(filepath, bscans, patient_id=1, study_id=2, series_id=3):
+    """
+    Writes a synthetic .e2e file holding a single OCT volume, its chunks being stored in the order given
+    :param bscans: (slice_id, words) of each b-scan, words being its (WIDTH, HEIGHT) 16-bit custom floats
+    """
+    chunks = [(0, 0, PATIENT_CHUNK, struct.pack('<31s66sI1s', b'JOHN', b'DOE', 123456, b'M')),
+              (0, 0, LATERALITY_CHUNK, bytes(14) + b'R')]
+    for slice_id, words in bscans:
+        chunks.append((slice_id, 1, IMAGE_CHUNK, struct.pack('<5I', words.nbytes, 0, 0, WIDTH, HEIGHT) +
+                       words.astype('<u2').tobytes()))
+    directory_position = 36 + 52
+    position = directory_position + 52 + len(chunks) * 44
+    entries, body = [], b''
+    for slice_id, ind, chunk_type, payload in chunks:
+        entries.append(struct.pack('<4I3IiHHII', directory_position, position, len(payload) + 60, 0, patient_id,
+                                   study_id, series_id, slice_id, 0, 0, chunk_type, 0))
+        header = struct.pack('<12s5I3IiHHII', b'MDbData', 0, 0, position, len(payload), 0, patient_id, study_id,
+                             series_id, slice_id, ind, 0, chunk_type, 0)
+        body += header + payload
+        position += len(header) + len(payload)
+    directory = struct.pack('<12sI10H4I', b'MDbMDir', 100, *range(10), len(chunks), directory_position, 0, 0)
+    sub_directory = struct.pack('<12sI10H4I', b'MDbDir', 100, *range(10), len(chunks), directory_position, 0, 0)
+    with open(filepath, 'wb') as f:
+        f.write(struct.pack('<12sI10H', b'CMDb', 100, *range(10)) + directory + sub_directory + b''.join(entries) +
+                body)
+
+
+def old_placement(bscans):
+    """ The volume as the b-scans were once placed, in a list indexed by int(slice_id / 2) - 1 in chunk order """
+    num_slices = int(max(slice_id for slice_id, words in bscans) / 2)
+    volume = [np.zeros((WIDTH, HEIGHT))] * num_slices
+    for slice_id, words in bscans:
+        volume[int(slice_id / 2) - 1] = custom_float_table(np.float64)[words]
+    return np.array(volume)
+
+
+@pytest.fixture
+def bscans():
+    """ Slice ids 2 to 10, then a slice id of 0 landing on the last b-scan, and a duplicate of slice id 4 """
+    rng = np.random.default_rng(0)
+    slice_ids = [2, 4, 6, 8, 10, 0, 4]
+    return [(slice_id, rng.integers(0, 65536, (WIDTH, HEIGHT), dtype=np.uint16)) for slice_id in slice_ids]
+
+
+@pytest.fixture
+def e2e_file(tmp_path, bscans):
+    filepath = str(tmp_path / 'volume.e2e')
+    write_e2e(filepath, bscans)
+    return filepath
+
+
+def test_positions_stay_in_volume(e2e_file):
+    reader = E2E(e2e_file)
+    key = reader.list_volumes()[0]['key']
+    positions = [position for position, words in reader.iter_raw_slices(key)]
+    assert positions == [0, 1, 2, 3, 4]
+
+
+def test_last_chunk_wins(e2e_file, bscans):
+    reader = E2E(e2e_file)
+    key = reader.list_volumes()[0]['key']
+    raw = dict(reader.iter_raw_slices(key))
+    # slice id 0 was stored after slice id 10, both landing on the last position
+    assert np.array_equal(raw[4], bscans[5][1])
+    assert np.array_equal(raw[1], bscans[6][1])
+
+
+def test_serial_decoding_matches_old_placement(e2e_file, bscans):
+    volume = E2E(e2e_file).read_oct_volume()[0]
+    assert np.array_equal(volume.volume, old_placement(bscans))
+    assert not volume.missing.any()
+
+
+@pytest.mark.parametrize('workers', [2, 3])
+def test_parallel_decoding_matches_serial(e2e_file, bscans, workers):
+    serial = E2E(e2e_file).read_oct_volume()[0]
+    parallel = E2E(e2e_file, workers=workers).read_oct_volume()[0]
+    assert np.array_equal(parallel.volume, serial.volume)
+    assert np.array_equal(parallel.volume, old_placement(bscans))
+    assert np.array_equal(parallel.missing, serial.missing)
+
+
+def test_parallel_volume_outlives_reader(e2e_file, bscans):
+    reader = E2E(e2e_file, workers=2)
+    pixels = reader.read_volume(reader.list_volumes()[0]['key']).volume
+    del reader
+    gc.collect()
+    assert np.array_equal(pixels, old_placement(bscans))
+
+
+@pytest.mark.parametrize('extension', ['.npy', '.png'])
+def test_saved_slices_stay_in_volume(e2e_file, tmp_path, extension):
+    reader = E2E(e2e_file)
+    key = reader.list_volumes()[0]['key']
+    written = save_slices(str(tmp_path / ('data' + extension)), reader.iter_raw_slices(key), 5)
+    if extension == '.npy':
+        assert np.array_equal(np.load(written[0]), np.array([words for position, words in
+                                                             reader.iter_raw_slices(key)]))
+    else:
+        assert sorted(written) == sorted(str(tmp_path / 'data_{}.png'.format(i)) for i in range(5))
@@ -0,0 +1,34 @@
+import json
+import subprocess
+import sys
+import pytest
+from conftest import EXPORT_FOLDER
+
+# imported by the code using them only, see oct_converter.image_types.oct
+HEAVY_MODULES = ['cv2', 'matplotlib', 'imageio', 'h5py', 'pydicom']
+# seconds, the exporters took about 1s to import when all the libraries were imported up front
+IMPORT_BUDGET = 0.6
+RUNS = 3
+
+SCRIPT = '''
+import json, sys, time
+tic = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - tic
+print(json.dumps({{'seconds': seconds, 'modules': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def cold_import(module):
+    """ Imports a module in a new interpreter, from the export folder as the scripts are run """
+    output = subprocess.run([sys.executable, '-c', SCRIPT.format(module=module, heavy=HEAVY_MODULES)],
+                            cwd=EXPORT_FOLDER, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+@pytest.mark.parametrize('module', ['e2eexporter', 'zeiss.zeiss_exporter'])
+def test_exporter_import_is_light(module):
+    results = [cold_import(module) for _ in range(RUNS)]
+    assert results[0]['modules'] == []
+    # the fastest run, as the others can be slowed down by the rest of the machine
+    assert min(result['seconds'] for result in results) < IMPORT_BUDGET
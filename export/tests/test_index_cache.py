@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from oct_converter.readers import E2E
+from oct_converter.readers import index_cache
+from oct_converter.readers.index_cache import IndexCache
+from test_e2e import write_e2e, WIDTH, HEIGHT
+
+
+@pytest.fixture
+def e2e_file(tmp_path):
+    rng = np.random.default_rng(0)
+    filepath = str(tmp_path / 'volume.e2e')
+    write_e2e(filepath, [(2 * (i + 1), rng.integers(0, 65536, (WIDTH, HEIGHT), dtype=np.uint16)) for i in range(3)])
+    return filepath
+
+
+@pytest.fixture
+def cache(tmp_path, e2e_file):
+    cache = IndexCache(str(tmp_path / 'cache'))
+    cache.put(e2e_file, E2E(e2e_file).build_index())
+    return cache
+
+
+def test_entry_is_used(cache, e2e_file):
+    index = cache.get(e2e_file)
+    assert index is not None
+    assert np.array_equal(index, E2E(e2e_file).build_index())
+    assert cache.prune() == []
+
+
+def test_modified_file_is_stale(cache, e2e_file):
+    with open(e2e_file, 'ab') as f:
+        f.write(b'\0')
+    assert cache.get(e2e_file) is None
+    assert cache.prune() == [e2e_file]
+
+
+def test_other_layout_is_stale(cache, e2e_file, monkeypatch):
+    monkeypatch.setattr(index_cache, 'INDEX_LAYOUT', index_cache.INDEX_LAYOUT + '_changed')
+    assert cache.get(e2e_file) is None
+    assert cache.rebuild([e2e_file]) == [e2e_file]
+    assert cache.get(e2e_file) is not None
+
+
+def test_entry_without_layout_is_stale(cache, e2e_file):
+    entry_path = cache.entry_path(e2e_file)
+    with np.load(entry_path) as entry:
+        fields = {name: entry[name] for name in entry.files if name != 'layout'}
+    with open(entry_path, 'wb') as f:
+        np.savez(f, **fields)
+    assert cache.get(e2e_file) is None
+    assert cache.prune() == [e2e_file]
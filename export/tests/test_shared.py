@@ -0,0 +1,83 @@
+import gc
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from oct_converter.image_types import OCTVolumeWithMetaData, FundusImageWithMetaData
+
+
+def filled_volume():
+    volume = OCTVolumeWithMetaData.empty(4, (8, 6), dtype=np.uint16, shared=True)
+    for index in range(4):
+        volume.set_slice(index, np.full((8, 6), index + 1))
+    return volume
+
+
+def test_view_outlives_owner():
+    volume = filled_volume()
+    view = volume.volume[1:]
+    volume.unlink()
+    del volume
+    gc.collect()
+    assert view.sum() == (2 + 3 + 4) * 48
+    view[0] = 7
+    assert view[0].sum() == 7 * 48
+
+
+def test_close_keeps_views_mapped():
+    volume = filled_volume()
+    view = volume.volume[2]
+    volume.close()
+    volume.unlink()
+    assert volume.volume is None
+    assert view.sum() == 3 * 48
+
+
+def test_private_volume_outlives_owner():
+    volume = filled_volume().make_private()
+    assert not volume.shared
+    pixels = volume.volume
+    del volume
+    gc.collect()
+    assert pixels.sum() == (1 + 2 + 3 + 4) * 48
+    # pickled by value once private
+    assert np.array_equal(pickle.loads(pickle.dumps(OCTVolumeWithMetaData(pixels))).volume, pixels)
+
+
+def test_with_block_frees_the_block():
+    with filled_volume() as volume:
+        name = volume._shm.name
+    assert volume.volume is None
+    try:
+        from multiprocessing import shared_memory
+        shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        pass
+    else:
+        raise AssertionError('block {} was not unlinked'.format(name))
+
+
+def sum_after_dropping_image(image, field):
+    """ Runs in a child process: drops the unpickled image, then reads and writes through a view of its pixels """
+    view = getattr(image, field)[1:]
+    image.close()
+    del image
+    gc.collect()
+    total = int(view.sum())
+    view[...] = 9
+    return total
+
+
+def test_unpickled_handle_in_child_process():
+    volume = filled_volume()
+    fundus = FundusImageWithMetaData(np.arange(24, dtype=np.uint8).reshape(4, 6)).to_shared()
+    try:
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            assert executor.submit(sum_after_dropping_image, volume, 'volume').result() == (2 + 3 + 4) * 48
+            assert executor.submit(sum_after_dropping_image, fundus, 'image').result() == sum(range(6, 24))
+        # written by the child to the same block
+        assert np.all(volume.volume[1:] == 9) and volume.volume[0].sum() == 48
+        assert np.all(fundus.image[1:] == 9)
+    finally:
+        for image in [volume, fundus]:
+            image.close()
+            image.unlink()
@@ -0,0 +1,162 @@
+"""
+The structured dtypes of readers.structures against the construct definitions the readers used before, kept here as
+fixtures, on random buffers.
+"""
+import numpy as np
+import pytest
+from oct_converter.readers import structures
+
+construct = pytest.importorskip('construct')
+from construct import Array, Int8un, Int16un, Int32sn, Int32un, PaddedString, Struct  # noqa: E402
+
+CONSTRUCT_STRUCTURES = {
+    'E2E_HEADER': Struct(
+        'magic' / PaddedString(12, 'ascii'),
+        'version' / Int32un,
+        'unknown' / Array(10, Int16un)
+    ),
+    'E2E_MAIN_DIRECTORY': Struct(
+        'magic' / PaddedString(12, 'ascii'),
+        'version' / Int32un,
+        'unknown' / Array(10, Int16un),
+        'num_entries' / Int32un,
+        'current' / Int32un,
+        'prev' / Int32un,
+        'unknown3' / Int32un,
+    ),
+    'E2E_SUB_DIRECTORY': Struct(
+        'pos' / Int32un,
+        'start' / Int32un,
+        'size' / Int32un,
+        'unknown' / Int32un,
+        'patient_id' / Int32un,
+        'study_id' / Int32un,
+        'series_id' / Int32un,
+        'slice_id' / Int32sn,
+        'unknown2' / Int16un,
+        'unknown3' / Int16un,
+        'type' / Int32un,
+        'unknown4' / Int32un,
+    ),
+    'E2E_CHUNK': Struct(
+        'magic' / PaddedString(12, 'ascii'),
+        'unknown' / Int32un,
+        'unknown2' / Int32un,
+        'pos' / Int32un,
+        'size' / Int32un,
+        'unknown3' / Int32un,
+        'patient_id' / Int32un,
+        'study_id' / Int32un,
+        'series_id' / Int32un,
+        'slice_id' / Int32sn,
+        'ind' / Int16un,
+        'unknown4' / Int16un,
+        'type' / Int32un,
+        'unknown5' / Int32un,
+    ),
+    'E2E_IMAGE': Struct(
+        'size' / Int32un,
+        'type' / Int32un,
+        'unknown' / Int32un,
+        'width' / Int32un,
+        'height' / Int32un,
+    ),
+    'E2E_PATIENT': Struct(
+        'name' / PaddedString(31, 'ascii'),
+        'surname' / PaddedString(66, 'ascii'),
+        'birthdate' / Int32un,
+        'sex' / PaddedString(1, 'ascii')
+    ),
+    'E2E_LATERALITY': Struct(
+        'unknown' / Array(14, Int8un),
+        'laterality' / PaddedString(1, 'ascii')
+    ),
+    'FDS_HEADER': Struct(
+        'FOCT' / PaddedString(4, 'ascii'),
+        'FDA' / PaddedString(3, 'ascii'),
+        'version_info_1' / Int32un,
+        'version_info_2' / Int32un
+    ),
+    # the second 'unknown' field overrode the first one, it is now named unknown2
+    'FDS_OCT_HEADER': Struct(
+        'unknown' / PaddedString(1, 'ascii'),
+        'width' / Int32un,
+        'height' / Int32un,
+        'bits_per_pixel' / Int32un,
+        'number_slices' / Int32un,
+        'unknown' / PaddedString(1, 'ascii'),
+        'size' / Int32un,
+    ),
+    'FDS_FUNDUS_HEADER': Struct(
+        'width' / Int32un,
+        'height' / Int32un,
+        'bits_per_pixel' / Int32un,
+        'number_slices' / Int32un,
+        'unknown' / PaddedString(1, 'ascii'),
+        'size' / Int32un,
+    ),
+}
+# fields of the structured dtypes named differently from the construct ones
+RENAMED = {'FDS_OCT_HEADER': {'unknown': 'unknown2'}}
+
+
+def random_buffer(structure, rng):
+    """ Random bytes for a header, with its strings made of printable ascii and null padded as they are in files """
+    raw = bytearray(rng.integers(0, 256, structure.itemsize, dtype=np.uint8).tobytes())
+    for name, (dtype, offset) in structure.fields.items():
+        if dtype.kind == 'S':
+            length = int(rng.integers(0, dtype.itemsize + 1))
+            text = rng.integers(32, 127, length, dtype=np.uint8).tobytes()
+            raw[offset:offset + dtype.itemsize] = text + b'\0' * (dtype.itemsize - length)
+    return bytes(raw)
+
+
+def assert_same_fields(name, record, container):
+    renamed = RENAMED.get(name, {})
+    for field in container:
+        if field.startswith('_'):
+            continue
+        value = record[renamed.get(field, field)]
+        expected = container[field]
+        if isinstance(value, bytes):
+            assert structures.to_str(value) == expected, field
+        elif isinstance(value, np.ndarray):
+            assert value.tolist() == list(expected), field
+        else:
+            assert int(value) == expected, field
+
+
+@pytest.mark.parametrize('name', sorted(CONSTRUCT_STRUCTURES))
+def test_parse(name):
+    structure = getattr(structures, name)
+    old = CONSTRUCT_STRUCTURES[name]
+    assert structure.itemsize == old.sizeof()
+    rng = np.random.default_rng(7)
+    for _ in range(200):
+        raw = random_buffer(structure, rng)
+        assert_same_fields(name, structures.parse(structure, raw), old.parse(raw))
+
+
+@pytest.mark.parametrize('name', sorted(CONSTRUCT_STRUCTURES))
+def test_parse_array(name):
+    structure = getattr(structures, name)
+    old = CONSTRUCT_STRUCTURES[name]
+    rng = np.random.default_rng(11)
+    buffers = [random_buffer(structure, rng) for _ in range(50)]
+    records = structures.parse_array(structure, b''.join(buffers), len(buffers))
+    assert len(records) == len(buffers)
+    for record, raw in zip(records, buffers):
+        assert_same_fields(name, record, old.parse(raw))
+
+
+def test_fds_oct_header_keeps_both_unknown_fields():
+    raw = random_buffer(structures.FDS_OCT_HEADER, np.random.default_rng(3))
+    record = structures.parse(structures.FDS_OCT_HEADER, raw)
+    assert record['unknown'] == raw[:1].rstrip(b'\0')
+    assert record['unknown2'] == raw[17:18].rstrip(b'\0')
+
+
+def test_parse_reads_a_prefix():
+    raw = random_buffer(structures.E2E_IMAGE, np.random.default_rng(5))
+    assert structures.parse(structures.E2E_IMAGE, raw + b'extra')['width'] == \
+        structures.parse(structures.E2E_IMAGE, raw)['width']
@@ -0,0 +1,173 @@
+import argparse
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from tqdm import tqdm
+from oct_converter.image_types import montage, montage_indices
+from oct_converter.image_types.oct import IMAGE_TYPES, VOLUME_TYPES
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+def slice_number(filename):
+    """ Position of a b-scan saved as data_<position>.<ext>, so that slices sort numerically """
+    match = re.search(r'(\d+)\.\w+$', filename)
+    return int(match.group(1)) if match else -1
+
+
+def source_mtime(source):
+    """ Modification time (ns) of a volume file, or latest one of a folder of slices and its files """
+    if os.path.isfile(source):
+        return os.stat(source).st_mtime_ns
+    return max([os.stat(source).st_mtime_ns] +
+               [entry.stat().st_mtime_ns for entry in os.scandir(source) if entry.is_file()])
+
+
+class ThumbnailCache:
+    """
+    On-disk cache of thumbnails, one .png per source keyed by the source's path and modification time, so that a
+    thumbnail is only rebuilt once its source changed
+    """
+    def __init__(self, folder):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def entry_prefix(self, source):
+        return hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()
+
+    def entry_path(self, source):
+        return os.path.join(self.folder, '{}_{}.png'.format(self.entry_prefix(source), source_mtime(source)))
+
+    def get(self, source):
+        """
+        :return: Path of the thumbnail of the source, or None if it has none or its thumbnail is stale
+        """
+        entry_path = self.entry_path(source)
+        return entry_path if os.path.exists(entry_path) else None
+
+    def put(self, source, image):
+        """
+        Stores the thumbnail of a source, removing its stale ones
+        :return: Path of the thumbnail
+        """
+        entry_path = self.entry_path(source)
+        prefix = self.entry_prefix(source)
+        for name in os.listdir(self.folder):
+            if name.startswith(prefix):
+                os.remove(os.path.join(self.folder, name))
+        tmp_path = '{}.{}.tmp.png'.format(entry_path[:-4], os.getpid())
+        if not cv2.imwrite(tmp_path, image):
+            raise IOError('Could not write {}'.format(tmp_path))
+        os.replace(tmp_path, entry_path)
+        return entry_path
+
+
+class ThumbnailBuilder:
+    """
+    Builds a montage thumbnail of every volume of an export tree, as written by E2EExporter and ZeissExporter: folders
+    of data_<i> slices, and .h5 or .npy volume files. Only the b-scans shown in the montages are read.
+    """
+    def __init__(self, root, cache_folder, rows=5, cols=5, tile_width=128, workers=8):
+        self.root = root
+        self.cache = ThumbnailCache(cache_folder)
+        self.rows = rows
+        self.cols = cols
+        self.tile_width = tile_width
+        self.workers = workers
+        # error of each source whose thumbnail could not be built by the last build, by path
+        self.failed = {}
+
+    def list_sources(self):
+        sources = []
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames.sort()
+            data = [f for f in filenames if f.startswith('data')]
+            if any(os.path.splitext(f)[1].lower() in IMAGE_TYPES for f in data):
+                sources.append(dirpath)
+            sources.extend(os.path.join(dirpath, f) for f in sorted(data)
+                           if os.path.splitext(f)[1].lower() in VOLUME_TYPES + ['.npy'])
+        return sources
+
+    def read_slices(self, source):
+        """
+        Reads the b-scans of a source shown in its montage
+        :return: list of np.array
+        """
+        count = self.rows * self.cols
+        extension = os.path.splitext(source)[1].lower()
+        if extension in VOLUME_TYPES:
+            if h5py is None:
+                raise ImportError('Reading volume files requires h5py')
+            with h5py.File(source, 'r') as f:
+                if 'data' not in f:
+                    # written without any slice
+                    raise ValueError('{} holds no b-scans'.format(source))
+                dataset = f['data']
+                return [dataset[index] for index in montage_indices(len(dataset), min(count, len(dataset)))]
+        if extension == '.npy':
+            volume = np.load(source, mmap_mode='r')
+            if volume.ndim == 2:
+                volume = volume[np.newaxis]
+            return [np.array(volume[index]) for index in montage_indices(len(volume), min(count, len(volume)))]
+        names = sorted([f for f in os.listdir(source) if f.startswith('data') and
+                        os.path.splitext(f)[1].lower() in IMAGE_TYPES], key=slice_number)
+        return [cv2.imread(os.path.join(source, names[index]), cv2.IMREAD_UNCHANGED)
+                for index in montage_indices(len(names), min(count, len(names)))]
+
+    def thumbnail(self, source):
+        """
+        :return: Path of the thumbnail of the source, from the cache if it is up to date
+        """
+        entry_path = self.cache.get(source)
+        if entry_path is None:
+            images = self.read_slices(source)
+            cols = self.cols if len(images) > 1 else 1
+            tile_width = self.tile_width if len(images) > 1 else self.tile_width * self.cols
+            entry_path = self.cache.put(source, montage(images, cols, tile_width))
+        return entry_path
+
+    def build(self):
+        """
+        Builds the missing and stale thumbnails of the export tree on a thread pool. A source that fails does not stop
+        the others, and is recorded in self.failed
+        :return: list of (source, thumbnail path)
+        """
+        sources = self.list_sources()
+        thumbnails = []
+        self.failed = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [(executor.submit(self.thumbnail, source), source) for source in sources]
+            for future, source in tqdm(futures):
+                try:
+                    thumbnails.append((source, future.result()))
+                except Exception as e:
+                    self.failed[source] = '{}: {}'.format(type(e).__name__, e)
+        return thumbnails
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dir", help="Export folder, searched recursively for volumes")
+    parser.add_argument("-c", "--cache", help="Folder where the thumbnails are written", default="thumbnails/")
+    parser.add_argument("-r", "--rows", help="Number of rows of b-scans in each montage", type=int, default=5)
+    parser.add_argument("-co", "--cols", help="Number of columns of b-scans in each montage", type=int, default=5)
+    parser.add_argument("-tw", "--tile_width", help="Width of each b-scan in a montage", type=int, default=128)
+    parser.add_argument("-w", "--workers", help="Number of volumes processed in parallel", type=int, default=8)
+    args = parser.parse_args()
+
+    builder = ThumbnailBuilder(args.dir, args.cache, args.rows, args.cols, args.tile_width, args.workers)
+    thumbnails = builder.build()
+    with open(os.path.join(args.cache, 'index.csv'), 'w') as f:
+        f.write('source,thumbnail\n')
+        for source, thumbnail in thumbnails:
+            f.write('"%s","%s"\n' % (source, thumbnail))
+    print('%i thumbnail(s) in %s, %i source(s) failed' % (len(thumbnails), args.cache, len(builder.failed)))
+    for source, error in builder.failed.items():
+        print('%s: %s' % (source, error))
@@ -1,14 +1,33 @@
 import os
+import sys
 import warnings
 import xml.dom.minidom
-from zeiss_reader import ZeissDecoder
+import numpy as np
+
+# the zeiss package, oct_converter and the export modules are imported from the export folder, also when this script is
+# run directly: python zeiss/zeiss_exporter.py, from the export folder or any other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from zeiss.zeiss_reader import ZeissDecoder, export_format
+from pipeline import Pipeline, Stage, image_stages, format_stats
+from planner import calibrate, estimated_formats, summarize
 import tqdm
 
 
 class ZeissExporter:
-    def __init__(self, data_folder, xml_folder):
+    def __init__(self, data_folder, xml_folder, workers=1, png_compression=None, format='.png', pipeline=None,
+                 queue_size=8):
+        """
+        :param pipeline: Number of threads of the read, encode and write stages by name, to export to .png through
+        export_pipelined
+        :param queue_size: Number of images waiting between two stages of the pipeline at most
+        """
         self.data_root = data_folder
         self.xml_root = xml_folder
+        self.workers = workers
+        self.png_compression = png_compression
+        self.format = export_format(format)
+        self.pipeline = pipeline
+        self.queue_size = queue_size
         self.xml_files = os.listdir(xml_folder)
         self.data_folders = os.listdir(data_folder)
 
@@ -34,22 +53,89 @@ class ZeissExporter:
         else:
             return patient_id[0]+'-'+patient_id[3:]
 
+    def read_patient(self, folder):
+        id_patient = self.extract_patient_id(folder)
+        xml_filename = self.find_xml_per_id(id_patient)
+        xml_filepath = os.path.join(self.xml_root, xml_filename)
+        doc = xml.dom.minidom.parse(xml_filepath)
+        patient_last_name = doc.getElementsByTagName('LAST_NAME')[0].firstChild.nodeValue
+        patient_first_name = doc.getElementsByTagName('FIRST_NAME')[0].firstChild.nodeValue
+        patient_id = doc.getElementsByTagName('PATIENT_ID')[0].firstChild.nodeValue
+        patient_id = self.refine_patient_id(patient_id)
+        return patient_id, patient_last_name, patient_first_name
+
+    def scan_metadata(self, folder):
+        """
+        Reads the patient and the images of a visit folder, without reading any pixel data
+        :param folder: Name of the visit folder in the data folder
+        :return: One dict per image, see ZeissDecoder.scan_metadata
+        """
+        patient_id, patient_last_name, patient_first_name = self.read_patient(folder)
+        rows = ZeissDecoder(os.path.join(self.data_root, folder)).scan_metadata()
+        for row in rows:
+            row.update(patient_id=patient_id, patient_name=patient_first_name, patient_surname=patient_last_name,
+                       visit_date=self.extract_visit_date(folder))
+        return rows
+
+    def patient_folder(self, folder):
+        patient_id, patient_last_name, patient_first_name = self.read_patient(folder)
+        return patient_id.upper()+' '+patient_last_name.upper()+', '+patient_first_name.upper()
+
+    def visit_folder(self, out_folder, folder):
+        return os.path.join(out_folder, self.patient_folder(folder), self.extract_visit_date(folder))
+
+    def estimate(self, sample=2, slices_per_volume=3):
+        """
+        Plans the export without writing anything: reads the size of the files of each visit folder, and times the
+        export of a few b-scans of the first folders, encoded in memory
+        :param sample: Number of visit folders the throughput is measured on
+        :param slices_per_volume: Number of b-scans of each file of the sample exported
+        :return: Totals of the export per patient folder and overall, see planner.summarize
+        """
+        rows = []
+        for folder in tqdm.tqdm(self.data_folders):
+            patient = self.patient_folder(folder)
+            for row in ZeissDecoder(os.path.join(self.data_root, folder)).scan_metadata():
+                rows.append({'patient': patient, 'source': folder, 'num_slices': row['num_slices'],
+                             'height': row['height'], 'width': row['width']})
+
+        def sample_images():
+            for folder in self.data_folders[:sample]:
+                for key, array in ZeissDecoder(os.path.join(self.data_root, folder)).read_arrays():
+                    array = np.squeeze(array)
+                    for image in ([array] if array.ndim == 2 else array[:slices_per_volume]):
+                        yield np.array(image)
+
+        seconds_per_pixel, bytes_per_pixel = calibrate(sample_images(), estimated_formats(self.format),
+                                                       self.png_compression)
+        workers = 1 if self.pipeline is None else min(self.pipeline.values())
+        return summarize(rows, seconds_per_pixel, bytes_per_pixel, workers)
+
+    def export_pipelined(self, out_folder):
+        """
+        Exports to .png through three stages running concurrently, each on its own threads and connected by bounded
+        queues: reading the images and b-scans of each visit folder, encoding them and writing them
+        :return: Statistics of the stages, see Pipeline.run
+        """
+        def read(folder):
+            decoder = ZeissDecoder(os.path.join(self.data_root, folder))
+            for filename, image in decoder.iter_images(self.visit_folder(out_folder, folder)):
+                yield folder, filename, image
+
+        stages = [Stage('read', read, self.pipeline.get('read', 1), self.queue_size)]
+        stages += image_stages('.png', self.png_compression, self.pipeline.get('encode', 1),
+                               self.pipeline.get('write', 1), self.queue_size)
+        return Pipeline(stages).run(self.data_folders)
+
     def export(self, out_folder):
+        if self.pipeline is not None and self.format == '.png':
+            print(format_stats(self.export_pipelined(out_folder)))
+            return
         for folder in tqdm.tqdm(self.data_folders):
-            visit_date = self.extract_visit_date(folder)
-            id_patient = self.extract_patient_id(folder)
-            xml_filename = self.find_xml_per_id(id_patient)
-            xml_filepath = os.path.join(self.xml_root, xml_filename)
-            doc = xml.dom.minidom.parse(xml_filepath)
-            patient_last_name = doc.getElementsByTagName('LAST_NAME')[0].firstChild.nodeValue
-            patient_first_name = doc.getElementsByTagName('FIRST_NAME')[0].firstChild.nodeValue
-            patient_id = doc.getElementsByTagName('PATIENT_ID')[0].firstChild.nodeValue
-            patient_id = self.refine_patient_id(patient_id)
-            folder_name = patient_id.upper()+' '+patient_last_name.upper()+', '+patient_first_name.upper()
-            zeiss_decoder = ZeissDecoder(os.path.join(self.data_root, folder))
+            zeiss_decoder = ZeissDecoder(os.path.join(self.data_root, folder), self.workers, self.png_compression,
+                                         self.format)
             zeiss_decoder.decode()
-            # print(os.path.join(out_folder, folder_name, visit_date))
-            zeiss_decoder.save(os.path.join(out_folder, folder_name, visit_date))
+            zeiss_decoder.save(self.visit_folder(out_folder, folder))
 
 
 if __name__ == '__main__':
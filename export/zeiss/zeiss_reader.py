@@ -1,11 +1,47 @@
 import os
 import numpy as np
-import cv2
+from oct_converter.image_types import write_images, write_hdf5
+from oct_converter.image_types.oct import VOLUME_TYPES
+
+
+# suffix of the file, scan size in its name, key of the array in ZeissDecoder.data, its shape and whether its
+# b-scans are stored upside down
+FILE_TYPES = [
+    ('_cube_z.img', '3mmx3mm', 'structural_oct_3mmx3mm', (-1, 1536, 300), True),
+    ('_cube_z.img', '6mmx6mm', 'structural_oct_6mmx6mm', (-1, 1536, 500), True),
+    ('_FlowCube_z.img', '3mmx3mm', 'angio_oct_3mmx3mm', (-1, 1536, 300), True),
+    ('_FlowCube_z.img', '6mmx6mm', 'angio_oct_6mmx6mm', (-1, 1536, 500), True),
+    ('_iris.bin', '', 'iris', (480, 640), False),
+    ('_lslo.bin', '', 'fundus_zeiss', (512, 664), False),
+]
+
+
+def export_format(format):
+    """
+    Normalizes an export format to a lower case extension with its dot
+    :return: .png, or one of VOLUME_TYPES
+    """
+    format = format.lower()
+    if not format.startswith('.'):
+        format = '.' + format
+    if format != '.png' and format not in VOLUME_TYPES:
+        raise NotImplementedError('Saving with file extension {} not supported'.format(format))
+    return format
 
 
 class ZeissDecoder:
-    def __init__(self, folder):
+    def __init__(self, folder, workers=1, png_compression=None, format='.png'):
+        """
+        :param folder: Visit folder containing the .img and .bin files
+        :param workers: Number of threads writing the b-scans of a cube, see write_images
+        :param png_compression: Compression level of the .png files, see write_images
+        :param format: .png to save each image and b-scan as a file, or .h5 to save each array as a single chunked
+        volume file, see write_hdf5
+        """
         self.folder = folder
+        self.workers = workers
+        self.png_compression = png_compression
+        self.format = export_format(format)
         self.data = {'fundus_zeiss': None,
                      'structural_oct_3mmx3mm': None,
                      'structural_oct_6mmx6mm': None,
@@ -19,36 +55,79 @@ class ZeissDecoder:
     def read_file(self, file, reshape):
         return np.fromfile(file, dtype=np.uint8).reshape(reshape)
 
-    def decode(self):
+    def recognized_files(self):
         for f in self.list_files:
-            file = os.path.join(self.folder, f)
-            if f.endswith('_cube_z.img'):
-                if '3mmx3mm' in f:
-                    self.data['structural_oct_3mmx3mm'] = self.read_file(file, (-1, 1536, 300))[:, ::-1, :]
-                if '6mmx6mm' in f:
-                    self.data['structural_oct_6mmx6mm'] = self.read_file(file, (-1, 1536, 500))[:, ::-1, :]
+            for suffix, scan_size, key, shape, flipped in FILE_TYPES:
+                if f.endswith(suffix) and scan_size in f:
+                    yield os.path.join(self.folder, f), key, shape, flipped
 
-            if f.endswith('_FlowCube_z.img'):
-                if '3mmx3mm' in f:
-                    self.data['angio_oct_3mmx3mm'] = self.read_file(file, (-1, 1536, 300))[:, ::-1, :]
-                if '6mmx6mm' in f:
-                    self.data['angio_oct_6mmx6mm'] = self.read_file(file, (-1, 1536, 500))[:, ::-1, :]
-
-            if f.endswith('_iris.bin'):
-                self.data['iris'] = self.read_file(file, (480, 640))
+    def decode(self):
+        for file, key, shape, flipped in self.recognized_files():
+            array = self.read_file(file, shape)
+            self.data[key] = array[:, ::-1, :] if flipped else array
 
-            if f.endswith('_lslo.bin'):
-                self.data['fundus_zeiss'] = self.read_file(file, (512, 664))
+    def scan_metadata(self):
+        """
+        Reads the number of slices and dimensions of each recognized file from its size, without reading it
+        :return: One dict per file, with its type (key in self.data), laterality, num_slices, height and width
+        """
+        rows = []
+        for file, key, shape, flipped in self.recognized_files():
+            num_slices = 1
+            if shape[0] == -1:
+                num_slices = os.path.getsize(file) // int(np.prod(shape[1:]))
+            rows.append({'type': key,
+                         'laterality': 'L' if self.eye == 'OS/' else 'R',
+                         'num_slices': num_slices,
+                         'height': shape[-2],
+                         'width': shape[-1]})
+        return rows
 
     def write_array(self, folder, array):
         array = np.squeeze(array)
         if not os.path.exists(folder):
             os.makedirs(folder)
+        if self.format in VOLUME_TYPES:
+            slices = enumerate(array) if array.ndim == 3 else [(0, array)]
+            write_hdf5(os.path.join(folder, 'data' + self.format), slices, len(array) if array.ndim == 3 else 1,
+                       {'type': os.path.basename(os.path.normpath(folder)),
+                        'laterality': 'L' if self.eye == 'OS/' else 'R'})
+            return
+        if self.format != '.png':
+            raise NotImplementedError('Saving with file extension {} not supported'.format(self.format))
         if array.ndim == 2:
-            cv2.imwrite(os.path.join(folder, 'data.png'), array)
+            images = [(os.path.join(folder, 'data.png'), array)]
         else:
-            for i, bscan in enumerate(array):
-                cv2.imwrite(os.path.join(folder, 'data_%i.png' % i), bscan)
+            images = ((os.path.join(folder, 'data_%i.png' % i), bscan) for i, bscan in enumerate(array))
+        write_images(images, self.workers, self.png_compression)
+
+    def read_arrays(self):
+        """
+        Maps the recognized files in memory, without reading them
+        :return: Generator of (key in self.data, np.array), flipped as by decode
+        """
+        # as with decode, a later file of the same type replaces an earlier one
+        files = {key: (file, shape, flipped) for file, key, shape, flipped in self.recognized_files()}
+        for key, (file, shape, flipped) in files.items():
+            array = np.memmap(file, dtype=np.uint8, mode='r').reshape(shape)
+            yield key, array[:, ::-1, :] if flipped else array
+
+    def iter_images(self, output_folder):
+        """
+        Reads the recognized files one image or b-scan at a time, as save would write them to .png
+        :param output_folder: Visit folder the images are saved to, see save
+        :return: Generator of (path of the .png, np.array)
+        """
+        for key, array in self.read_arrays():
+            folder = os.path.join(output_folder, self.eye, key)
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            array = np.squeeze(array)
+            if array.ndim == 2:
+                yield os.path.join(folder, 'data.png'), np.array(array)
+            else:
+                for i, bscan in enumerate(array):
+                    yield os.path.join(folder, 'data_%i.png' % i), np.array(bscan)
 
     def save(self, output_folder):
         if not os.path.exists(output_folder):
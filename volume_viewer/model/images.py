@@ -4,6 +4,13 @@ import re
 import cv2
 import numpy as np
 
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+VOLUME_TYPES = ('.h5', '.hdf5')
+
 
 def atoi(text):
     return int(text) if text.isdigit() else text
@@ -42,6 +49,9 @@ def read_images_to_np(folder, imread_flag=cv2.IMREAD_UNCHANGED, progress_functio
     :return:
     """
     list_images_name = os.listdir(folder)
+    volume_files = [name for name in list_images_name if name.lower().endswith(VOLUME_TYPES)]
+    if volume_files:
+        return read_volume_to_np(os.path.join(folder, volume_files[0]), progress_function=progress_function)
     n = len(list_images_name)
     if n > 1:
         list_images_name.sort(key=natural_keys)
@@ -68,3 +78,39 @@ def read_images_to_np(folder, imread_flag=cv2.IMREAD_UNCHANGED, progress_functio
 
         img = np.expand_dims(img, 0)
         return img
+
+
+def read_volume_to_np(filepath, indices=None, progress_function=None):
+    """
+    Reads the slices of a volume file saved by the exporters (.h5), in the same layout as read_images_to_np.
+    Each slice is stored as its own chunk, so only the requested slices are read and decompressed
+    :param filepath: Path of the volume file
+    :param indices: Positions of the slices to read, all of them if None
+    :return:
+    """
+    if h5py is None:
+        raise ImportError('Reading volume files requires h5py')
+    with h5py.File(filepath, 'r') as f:
+        dataset = f['data']
+        if indices is None:
+            indices = range(len(dataset))
+        n = len(indices)
+        if n == 1:
+            img = dataset[indices[0]]
+            if img.ndim == 2:
+                img = cv2.merge((img, img, img, img))
+            if img.ndim == 3:
+                img = cv2.cvtColor(img, cv2.COLOR_BGR2RGBA)
+            return np.expand_dims(img, 0)
+        for i, index in enumerate(indices):
+            img = dataset[index]
+            if img.ndim == 2:
+                img = cv2.merge((img, img, img, np.ones_like(img) * 255))
+            if i == 0:
+                imgs = np.empty((n,) + img.shape, dtype=img.dtype)
+            imgs[i] = img
+
+            if progress_function is not None:
+                progress_function(100 * i / n)
+
+    return np.moveaxis(imgs, 2, 1)